@@ -1 +1,26 @@
-from .mappersession import save, load, unload, load_json, clear, tags
+# The implementation is imported on first use, so that the command-line client can hand commands to
+# a running daemon without loading libmapper and jsonschema
+_exports = {
+    "save": "mappersession", "load": "mappersession", "unload": "mappersession", "load_json": "mappersession",
+    "clear": "mappersession", "tags": "mappersession", "tag_counts": "mappersession",
+    "last_stats": "mappersession", "SessionStats": "mappersession", "set_sync": "mappersession",
+    "migrate": "mappersession", "set_cache": "mappersession", "compile_device_map": "mappersession",
+    "SessionJournal": "mappersession", "record": "mappersession", "replay_journal": "mappersession",
+    "compact_journal": "mappersession", "list_staged": "mappersession", "cancel_staged": "mappersession",
+    "extend_staged": "mappersession", "SessionManager": "mappersession", "get_manager": "mappersession",
+    "SessionService": "service",
+}
+_submodules = ["mappersession", "service", "daemon"]
+
+__all__ = list(_exports)
+
+def __getattr__(name):
+    import importlib
+    if name in _submodules:
+        return importlib.import_module("." + name, __name__)
+    if name in _exports:
+        return getattr(importlib.import_module("." + _exports[name], __name__), name)
+    raise AttributeError("module '{0}' has no attribute '{1}'".format(__name__, name))
+
+def __dir__():
+    return __all__ + _submodules
@@ -1,5 +1,11 @@
 import sys
+import os
 import argparse
+import logging
+import json
+import socket
+import tempfile
+import datetime
 
 def createParser():
     parser = argparse.ArgumentParser(description="Save or load a mapping session")
@@ -17,6 +23,52 @@ def createParser():
         '--save', type=ascii,
         metavar='PATH',
         help="Save mapping session as JSON file")
+    parser.add_argument(
+        '--migrate', nargs='+',
+        metavar='PATH',
+        help="Upgrade legacy session files, or all session files in directories, to the current file version")
+    parser.add_argument(
+        '--record', metavar='JOURNAL',
+        help="Record changes to maps on the network in a session journal until stopped")
+    parser.add_argument(
+        '--record_session', metavar='PATH',
+        help="While recording, periodically compact the journal into this session file")
+    parser.add_argument(
+        '--compact_interval', type=float,
+        metavar='SECONDS',
+        help="Seconds between compactions of the journal while recording (default: 60).")
+    parser.add_argument(
+        '--compact_journal', nargs=2,
+        metavar=('JOURNAL', 'PATH'),
+        help="Fold a session journal into a session file")
+    parser.add_argument(
+        '--until', type=journal_time,
+        metavar='TIME',
+        help="Load or compact a session journal as it was at this time, given as seconds since the epoch or an ISO 8601 date and time")
+    parser.add_argument(
+        '--workers', type=int,
+        metavar='N',
+        help="Number of worker processes used by --migrate (default: one per CPU) and to prepare the files of --load (default: none).")
+    parser.add_argument(
+        '--compact', action=argparse.BooleanOptionalAction,
+        help="Save the session file without indentation")
+    parser.add_argument(
+        '--tables', action=argparse.BooleanOptionalAction,
+        help="Save the session file with device and signal tables and default map properties")
+    parser.add_argument(
+        '--save_devices', nargs='+',
+        metavar='NAME',
+        help="Only save maps connected to these devices")
+    parser.add_argument(
+        '--save_signals', nargs='+',
+        metavar='PREFIX',
+        help="Only save maps connected to signals whose full name (device/signal) starts with one of these prefixes")
+    parser.add_argument(
+        '--save_tag', metavar='TAG',
+        help="Only save maps with this session tag")
+    parser.add_argument(
+        '--incremental', action=argparse.BooleanOptionalAction,
+        help="Reuse the saved records of maps that haven't changed since the session file was last saved")
     parser.add_argument(
         '--clear', action=argparse.BooleanOptionalAction,
         help="Clear currently active maps")
@@ -33,51 +85,216 @@ def createParser():
     parser.add_argument(
         '--persist', action=argparse.BooleanOptionalAction,
         help="Remain active during session load and (re)create maps as they appear.")
+    parser.add_argument(
+        '--reconcile', action=argparse.BooleanOptionalAction,
+        help="Only create missing maps and update changed maps during session load.")
+    parser.add_argument(
+        '--release', action=argparse.BooleanOptionalAction,
+        help="With --reconcile, also release active maps that are not part of the loaded session.")
+    parser.add_argument(
+        '--match', choices=['all', 'same_ordinal', 'nearest_name', 'first_match'],
+        help="How signals matched by name on different devices are combined into maps (default: all).")
+    parser.add_argument(
+        '--max_fanout', type=int,
+        metavar='N',
+        help="Maximum number of maps created for each map in a session file (default: 256).")
+    parser.add_argument(
+        '--device_map', type=device_map_rule,
+        nargs='+',
+        metavar='RULE',
+        help="Translate device names in the session files, each RULE is FROM=TO or a JSON file containing an object of rules. FROM may be a glob or a regular expression prefixed with 're:', and TO may use {name}, {base}, {ordinal} and {ordinal+N}.")
     parser.add_argument(
         '--interactive', action=argparse.BooleanOptionalAction,
         help="Create libmapper signals for managing file loading and unloading.")
     parser.add_argument(
         '--description', type=ascii,
         help="Description of session, used when saving")
+    parser.add_argument(
+        '--sync_quiet', type=float,
+        metavar='SECONDS',
+        help="Consider the network synced once nothing has changed for this long (default: 0.2).")
+    parser.add_argument(
+        '--sync_timeout', type=float,
+        metavar='SECONDS',
+        help="Maximum time to spend syncing with the network (default: 5).")
+    parser.add_argument(
+        '--cache', metavar='DIR',
+        help="Cache prepared session files in this directory so unchanged files load without being parsed and validated again.")
+    parser.add_argument(
+        '--verbose', action=argparse.BooleanOptionalAction,
+        help="Log every signal search, property and map.")
+    parser.add_argument(
+        '--quiet', action=argparse.BooleanOptionalAction,
+        help="Only log warnings and errors.")
+    parser.add_argument(
+        '--stats', action=argparse.BooleanOptionalAction,
+        help="Print timings and counts for each operation.")
+    parser.add_argument(
+        '--daemon', action=argparse.BooleanOptionalAction,
+        help="Run a resident daemon that keeps a synced graph for other mappersession commands. With --no-daemon, run the command in this process even if a daemon is running.")
+    parser.add_argument(
+        '--stop_daemon', action=argparse.BooleanOptionalAction,
+        help="Stop the running daemon.")
+    parser.add_argument(
+        '--socket', metavar='PATH',
+        help="Control socket of the daemon (default: $MAPPERSESSION_SOCKET or mappersession-USER.sock in the temporary directory).")
     # TODO:
     # Overwrite save file
     #
     return parser
 
-if __name__ == '__main__':
+# Parses a --device_map argument into a dictionary of rules
+def device_map_rule(rule):
+    if '=' in rule and not os.path.isfile(rule):
+        key, target = rule.split('=', 1)
+        return {key: target}
     try:
-        import mappersession as session
-    except:
-        try:
-            sys.path.append(
-                            os.path.join(os.path.join(os.getcwd(),
-                                                      os.path.dirname(sys.argv[0])),
-                                         './mappersession'))
-            import mappersession as session
-        except:
-            print('Error importing mappersession module.')
-            sys.exit(1)
+        with open(rule) as f:
+            rules = json.load(f)
+    except (OSError, ValueError) as err:
+        raise argparse.ArgumentTypeError("expected FROM=TO or a JSON file of rules: {0}".format(err))
+    if not isinstance(rules, dict):
+        raise argparse.ArgumentTypeError("{0} does not contain an object of device_map rules".format(rule))
+    return rules
 
-    # Parse arguments
-    parser = createParser()
-    args = parser.parse_args()
+# Parses an --until argument into seconds since the epoch
+def journal_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected seconds since the epoch or an ISO 8601 date and time")
+
+def default_socket_path():
+    path = os.environ.get("MAPPERSESSION_SOCKET")
+    if path:
+        return path
+    try:
+        user = str(os.getuid())
+    except AttributeError:
+        user = os.environ.get("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), "mappersession-{0}.sock".format(user))
+
+# Commands that keep running after they return, and so can't be handled by the daemon
+def needs_local_process(args):
+    return bool(args.interactive or args.wait or args.wait_seconds is not None or args.persist or args.record)
+
+def send_to_daemon(path, request):
+    """sends a request to a running daemon, returning its response or None if no daemon is listening"""
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            data = b"".join(iter(lambda: sock.recv(65536), b""))
+    except (ConnectionRefusedError, FileNotFoundError):
+        return None
+    return json.loads(data)
+
+def run_commands(session, args, graph=None):
+    """runs the save, clear, unload, load and print commands in 'args' using 'graph'"""
     should_clear = args.clear if args.clear != None else False
 
+    def print_stats():
+        if args.stats:
+            print(session.last_stats())
+
+    if (args.migrate is not None):
+        results = session.migrate(args.migrate, workers=args.workers)
+        if args.stats:
+            for result in results:
+                print("{0:>9} {1:8.1f} ms  {2}".format(result["status"], result["seconds"] * 1000, result["file"]))
+    if (args.compact_journal is not None):
+        session.compact_journal(args.compact_journal[0], args.compact_journal[1], until=args.until,
+                                compact=args.compact if args.compact != None else False,
+                                tables=args.tables if args.tables != None else False)
     if (args.save is not None):
-        session.save(args.save, args.description if args.description != None else "")
+        session.save(args.save, args.description if args.description != None else "",
+                     compact=args.compact if args.compact != None else False, stream=True, graph=graph,
+                     tables=args.tables if args.tables != None else False, devices=args.save_devices,
+                     signals=args.save_signals, tag=args.save_tag,
+                     incremental=args.incremental if args.incremental != None else False)
+        print_stats()
     if should_clear:
         # clear after save and before load
-        session.clear()
+        session.clear(graph=graph)
+        print_stats()
     elif (args.unload is not None):
         filenames = [path.name for path in args.unload]
-        session.unload(filenames)
+        session.unload(filenames, graph=graph)
+        print_stats()
     if (args.load is not None):
         interactive = args.interactive if args.interactive != None else False
         wait = args.wait if args.wait != None else False
         if args.wait == None and args.wait_seconds != None:
             wait = args.wait_seconds
         persist = args.persist if args.persist != None else False
+        reconcile = args.reconcile if args.reconcile != None else False
+        release = args.release if args.release != None else False
         filenames = [path.name for path in args.load]
-        session.load(filenames, interactive=interactive, wait=wait, persist=persist)
+        match = args.match if args.match != None else "all"
+        max_fanout = args.max_fanout if args.max_fanout != None else 256
+        device_map = None
+        if args.device_map is not None:
+            device_map = {}
+            for rules in args.device_map:
+                device_map.update(rules)
+        session.load(filenames, interactive=interactive, wait=wait, persist=persist, reconcile=reconcile,
+                     release=release, match=match, max_fanout=max_fanout, device_map=device_map, graph=graph,
+                     until=args.until, workers=args.workers)
+        print_stats()
+    if (args.record is not None):
+        session.record(args.record, graph=graph, session_filename=args.record_session,
+                       interval=args.compact_interval if args.compact_interval != None else 60.0)
     if (args.print_session_tags is not None):
-        print('active session tags:', session.tags())
+        print('active session tags:', session.tags(graph))
+
+if __name__ == '__main__':
+    # Parse arguments
+    parser = createParser()
+    args = parser.parse_args()
+    socket_path = args.socket if args.socket else default_socket_path()
+
+    # Hand the command to a running daemon, which already has a synced graph
+    if args.stop_daemon or (args.daemon is None and not needs_local_process(args)):
+        response = send_to_daemon(socket_path, {"argv": sys.argv[1:], "cwd": os.getcwd()})
+        if response is not None:
+            sys.stdout.write(response["stdout"])
+            sys.stderr.write(response["stderr"])
+            sys.exit(response["status"])
+        elif args.stop_daemon:
+            print('No mappersession daemon is running.')
+            sys.exit(1)
+
+
+    try:
+        import mappersession as session
+    except:
+        try:
+            sys.path.append(
+                            os.path.join(os.path.join(os.getcwd(),
+                                                      os.path.dirname(sys.argv[0])),
+                                         './mappersession'))
+            import mappersession as session
+        except:
+            print('Error importing mappersession module.')
+            sys.exit(1)
+
+    level = logging.DEBUG if args.verbose else logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(format="%(message)s", level=level)
+    session.set_sync(args.sync_quiet if args.sync_quiet != None else 0.2,
+                     args.sync_timeout if args.sync_timeout != None else 5.0)
+    if args.cache:
+        session.set_cache(args.cache)
+
+    if args.daemon:
+        from mappersession.daemon import serve
+        serve(socket_path)
+        sys.exit(0)
+
+    run_commands(session, args)
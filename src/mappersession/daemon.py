@@ -0,0 +1,141 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import socket
+import traceback
+from . import mappersession as session
+from .__main__ import createParser, run_commands, default_socket_path, needs_local_process
+
+logger = logging.getLogger("mappersession")
+
+def serve(path=None, graph=None):
+    """runs a resident daemon that handles mappersession commands from the command line
+
+    The daemon keeps a synced graph along with the signal and session tag indexes, validated files and
+    session ownership, so commands sent to it don't pay for importing libmapper or syncing a new
+    graph. Commands are received as command-line arguments on a Unix domain socket and their
+    output is sent back to be printed by the client.
+
+    :optional param path (String): Path of the control socket, default from default_socket_path()
+    :optional param graph (libmapper Graph object): A previously-allocated libmapper graph object to use. If not provided one will be allocated and synced.
+    :return (None): Blocks until stopped with --stop_daemon or CTL+C
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        logger.error("the mappersession daemon needs Unix domain sockets, which aren't available on this platform")
+        return
+    path = path or default_socket_path()
+    if os.path.exists(path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # left behind by a daemon that didn't exit cleanly
+                os.unlink(path)
+            else:
+                logger.error("a mappersession daemon is already running on %s", path)
+                return
+
+    # commands run with the daemon's graph use its manager, see mappersession.get_manager()
+    graph = session.check_graph(graph)
+    manager = session.SessionManager(graph)
+    manager.get_sig_index()
+    manager.get_tag_index()
+    session.install_stop_handlers()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen()
+        server.setblocking(False)
+        logger.info("mappersession daemon listening on %s", path)
+        running = True
+        while running and not session.stop_session:
+            with manager.lock:
+                graph.poll(10)
+            while running:
+                try:
+                    conn, address = server.accept()
+                except BlockingIOError:
+                    break
+                with conn:
+                    running = handle_connection(conn, graph)
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.unlink(path)
+        manager.close()
+    logger.info("mappersession daemon stopped")
+
+# Runs the command sent on a connection and replies with its output
+# Returns False if the daemon should stop
+def handle_connection(conn, graph):
+    conn.setblocking(True)
+    conn.settimeout(5)
+    try:
+        data = b"".join(iter(lambda: conn.recv(65536), b""))
+        request = json.loads(data)
+    except (OSError, ValueError) as err:
+        logger.error("invalid request: %s", err)
+        return True
+
+    response, running = run_request(request, graph)
+    try:
+        conn.sendall(json.dumps(response).encode())
+    except OSError as err:
+        logger.error("failed to send response: %s", err)
+    return running
+
+# Runs a request's command-line arguments, capturing what they print and log
+def run_request(request, graph):
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    handler = logging.StreamHandler(stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    level = logger.level
+    propagate = logger.propagate
+    cwd = os.getcwd()
+    sync = (session.sync_quiet, session.sync_timeout)
+    cache = session.session_cache
+    status = 0
+    running = True
+    args = None
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            os.chdir(request.get("cwd", cwd))
+            args = createParser().parse_args(request["argv"])
+            logger.addHandler(handler)
+            logger.propagate = False
+            logger.setLevel(logging.DEBUG if args.verbose else logging.WARNING if args.quiet else logging.INFO)
+            if args.stop_daemon:
+                print("stopping mappersession daemon")
+                running = False
+            elif args.daemon or needs_local_process(args):
+                print("error: this command can't be run by the daemon, use --no-daemon")
+                status = 1
+            else:
+                # the request's sync and cache options replace the daemon's own while it runs
+                session.set_sync(args.sync_quiet if args.sync_quiet != None else sync[0],
+                                 args.sync_timeout if args.sync_timeout != None else sync[1])
+                if args.cache:
+                    session.set_cache(args.cache)
+                run_commands(session, args, graph)
+    except SystemExit as err:
+        # raised by argparse for invalid arguments and --help
+        status = err.code if isinstance(err.code, int) else 1
+    except Exception:
+        stderr.write(traceback.format_exc())
+        status = 1
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = propagate
+        logger.setLevel(level)
+        os.chdir(cwd)
+        session.set_sync(*sync)
+        session.session_cache = cache
+        if args is not None:
+            for file in (args.load or []) + (args.unload or []):
+                file.close()
+    return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "status": status}, running
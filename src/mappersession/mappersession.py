@@ -2,310 +2,1661 @@ import sys
 import time
 import platform
 import json
+import os
+import gzip
+import bz2
+import lzma
 import jsonschema
+import logging
+import contextlib
 import libmapper as mpr
-from jsonschema import validate
 import pkgutil
 import threading
+import multiprocessing
+import concurrent.futures
 import re
+import functools
+import difflib
+import fnmatch
 if platform.system() == 'Windows':
     import msvcrt
 else:
     import select
 import itertools, signal
-
-current_fileversion = "2.4"
-g = None
-staging_thread = None
+import heapq
+import math
+import tempfile
+import collections
+import copy
+import hashlib
+import pickle
+
+current_fileversion = "2.5"
+# Version written for sessions that don't use the device and signal tables added in 2.5, so releases
+# that only read 2.4 can still load them, see session_fileversion()
+plain_fileversion = "2.4"
+logger = logging.getLogger("mappersession")
+# The process umask, so files written through a temporary file get the permissions open() would give them
+file_umask = os.umask(0o022)
+os.umask(file_umask)
+# Compressed session file extensions
+compressed_extensions = [".gz", ".bz2", ".xz", ".zst"]
+# Session journals written by record(), see SessionJournal
+journal_extension = ".journal"
+# Set by SIGINT or SIGTERM to stop interactive sessions, staging, recording and the daemon, see install_stop_handlers()
 stop_session = False
-
-# Bookkeeping for maps
-staged_maps = []
-# Session files
-session_filenames = []
+stop_handlers_installed = False
+
+# Compiled session schema validator, created on first use
+schema_validator = None
+# Session files that passed validation, keyed by path with their (mtime, size) at that time
+validated_files = {}
+# Statistics of the most recent load, unload, save or clear
+latest_stats = None
+# A newly allocated graph is synced until nothing has appeared on it for 'sync_quiet' seconds, for at
+# most 'sync_timeout' seconds, see set_sync()
+sync_quiet = 0.2
+sync_timeout = 5.0
+# Persistent cache of prepared session files, see set_cache()
+session_cache = None
+# Map records of the session files written by save(), keyed by path with the file's (mtime, size),
+# so that incremental saves don't need to read the file again
+saved_sessions = {}
 
 def handler_stop_session(signum, frame):
     global stop_session
     stop_session = True
-    if staging_thread != None:
-        staging_thread.stop()
 
-signal.signal(signal.SIGINT, handler_stop_session)
-signal.signal(signal.SIGTERM, handler_stop_session)
+def install_stop_handlers():
+    """makes SIGINT and SIGTERM stop interactive sessions, staging and recording
+
+    Called by the blocking functions rather than on import, so importing mappersession leaves the
+    application's signal handlers alone. Does nothing outside the main thread.
+    """
+    global stop_handlers_installed
+    if stop_handlers_installed or threading.current_thread() is not threading.main_thread():
+        return
+    signal.signal(signal.SIGINT, handler_stop_session)
+    signal.signal(signal.SIGTERM, handler_stop_session)
+    stop_handlers_installed = True
 
-def check_graph(graph, sync=True):
-    global g
+def check_graph(graph, sync=True, stats=None):
+    """returns 'graph', or a newly allocated graph that is synced unless 'sync' is False"""
     if not graph:
-        g = mpr.Graph()
+        graph = mpr.Graph()
         if sync:
-            print('syncing graph...')
-            g.poll(2000)
-    else:
-        g = graph
-    return g
+            logger.info('syncing graph...')
+            result = sync_graph(graph)
+            if stats is not None:
+                stats.sync = result
+    return graph
+
+# The libmapper binding keeps graph callbacks in process-wide sets that it loops over for the events of
+# every graph, so a callback added or removed by one thread while another polls can break the dispatch.
+# mappersession adds a single callback once and passes events on to the handlers of each graph.
+graph_handlers_lock = threading.Lock()
+# (graph, handler, types) for every handler, replaced rather than changed so dispatch_graph_event()
+# can loop over it while handlers are added and removed
+graph_handlers = []
+graph_dispatcher_added = False
+
+def add_graph_handler(graph, handler, types=mpr.Type.OBJECT):
+    """calls 'handler' with the type, object and event of each change of the given types on 'graph'
+
+    Adding a handler that was already added replaces its graph and types.
+    """
+    global graph_handlers, graph_dispatcher_added
+    with graph_handlers_lock:
+        graph_handlers = [entry for entry in graph_handlers if entry[1] != handler] + [(graph, handler, types)]
+        if not graph_dispatcher_added:
+            graph.add_callback(dispatch_graph_event, mpr.Type.DEVICE | mpr.Type.SIGNAL | mpr.Type.MAP)
+            graph_dispatcher_added = True
+
+def remove_graph_handler(handler):
+    """stops calling a handler added with add_graph_handler()"""
+    global graph_handlers
+    with graph_handlers_lock:
+        graph_handlers = [entry for entry in graph_handlers if entry[1] != handler]
+
+def dispatch_graph_event(type, obj, event):
+    handlers = graph_handlers
+    if not handlers:
+        return
+    graph_obj = obj.graph()._obj
+    for graph, handler, types in handlers:
+        if type & types and graph._obj == graph_obj:
+            try:
+                handler(type, obj, event)
+            except Exception as err:
+                # an error must not stop the events reaching the handlers of other graphs and managers
+                logger.error("error in graph callback: %s", err)
+
+def sync_graph(graph, quiet=None, timeout=None):
+    """polls a graph until no devices, signals or maps have appeared or changed for 'quiet' seconds
+
+    :param graph (libmapper Graph object): The graph to sync
+    :optional param quiet (Float): Seconds without graph events before the graph is considered synced, default sync_quiet
+    :optional param timeout (Float): Maximum number of seconds to wait, default sync_timeout
+    :return (Dict): 'seconds' spent syncing, the number of graph 'events' seen and whether the graph 'settled' before the timeout
+    """
+    quiet = sync_quiet if quiet is None else quiet
+    timeout = sync_timeout if timeout is None else timeout
+    events = 0
+    start = last_event = time.monotonic()
+
+    def on_event(type, obj, event):
+        nonlocal events, last_event
+        events += 1
+        last_event = time.monotonic()
+
+    add_graph_handler(graph, on_event, mpr.Type.DEVICE | mpr.Type.SIGNAL | mpr.Type.MAP)
+    try:
+        while True:
+            now = time.monotonic()
+            settled = now - last_event >= quiet
+            if settled or now - start >= timeout:
+                break
+            remaining = min(quiet - (now - last_event), timeout - (now - start))
+            graph.poll(max(1, min(50, int(remaining * 1000))))
+    finally:
+        remove_graph_handler(on_event)
+    seconds = time.monotonic() - start
+    if not settled:
+        logger.warning("graph sync stopped after %.1f seconds before the network was quiet, some devices may be missing", seconds)
+    logger.debug("synced graph in %.3f seconds (%d events)", seconds, events)
+    return {"seconds": seconds, "events": events, "settled": settled}
+
+def set_sync(quiet=0.2, timeout=5.0):
+    """sets how long newly allocated graphs are synced before use
+
+    A graph is used once no devices, signals or maps have appeared or changed on it for 'quiet'
+    seconds, or after 'timeout' seconds if it keeps changing.
+
+    :optional param quiet (Float): Seconds without graph events, default 0.2
+    :optional param timeout (Float): Maximum number of seconds to sync, default 5.0
+    """
+    global sync_quiet, sync_timeout
+    sync_quiet = quiet
+    sync_timeout = timeout
+
+class SessionManager:
+    """Loads, unloads and saves sessions on one libmapper graph.
+
+    A manager owns everything mappersession keeps for its graph: the signal and session tag indexes,
+    which loaded sessions own which maps, the plans of an interactive session, and the staging queue
+    with its thread. Operations on a manager are serialised by its lock, which the staging thread
+    also holds while it polls the graph, so a manager can be used from several threads. Managers on
+    different graphs are independent and can be used in parallel, e.g. one for each network interface.
+
+    The module functions (load(), save(), unload(), ...) use the manager registered for the graph
+    they are given, see get_manager().
+
+    Example:
+        graph = mpr.Graph()
+        graph.set_interface("eth1")
+        manager = SessionManager(graph)
+        manager.load("session1.json", wait=10, background=True)
+        ...
+        manager.close()
+    """
+
+    def __init__(self, graph=None):
+        """
+        :optional param graph (libmapper Graph object): The graph to manage. If not provided one will be allocated and synced when first needed, and synced again before each operation.
+        """
+        self.graph = graph
+        # graph allocated by the manager, which it syncs before each operation and frees when closed
+        self.owned_graph = None
+        self.lock = threading.RLock()
+        # set by stop() to end the staging thread and interactive sessions
+        self.stopping = False
+        self.latest_stats = None
+        # Name index of devices and signals on the graph
+        self.sig_index = None
+        # Index of maps on the graph by session tag
+        self.tag_index = None
+        # Loaded sessions that own each map created by mappersession, keyed by map_key()
+        self.map_owners = {}
+        # Keys of the maps owned by each loaded session
+        self.session_map_keys = {}
+        # Keys of owned maps by map id
+        self.owned_map_keys = {}
+        # Session files of an interactive session and their signal matching options
+        self.session_filenames = []
+        self.session_plan_options = {}
+        # Prepared sessions with their maps resolved against the graph, keyed by filename
+        self.session_plans = {}
+        # Staged maps by handle, see stage_maps()
+        self.staged_maps = {}
+        # Staged maps indexed by the names of their source and destination signals, then by handle
+        self.staged_by_sig = {}
+        # Heap of (deadline, handle) for staged maps that expire. Entries whose deadline no longer
+        # matches their staged map are stale and skipped, so cancelling or extending doesn't search it
+        self.staging_deadlines = []
+        self.staging_handles = itertools.count(1)
+        # Heap of (time, handle) for staged maps that failed or timed out and are tried again at that time
+        self.staging_retries = []
+        # Names of signals that appeared since the staged maps were last tried
+        self.new_sig_names = set()
+        self.staging_thread = None
+        if graph is not None:
+            register_manager(self)
+
+    def close(self):
+        """stops staging, removes the manager's graph callbacks and frees the graph if it allocated it"""
+        self.stop()
+        thread = self.staging_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        with self.lock:
+            if self.sig_index is not None:
+                self.sig_index.close()
+                self.sig_index = None
+            if self.tag_index is not None:
+                self.tag_index.close()
+                self.tag_index = None
+            remove_graph_handler(self.on_owned_map_event)
+            if self.graph is not None:
+                unregister_manager(self)
+            if self.owned_graph is not None:
+                self.owned_graph.free()
+                if self.graph is self.owned_graph:
+                    self.graph = None
+                self.owned_graph = None
+
+    def stop(self):
+        """stops the staging thread and any interactive session"""
+        self.stopping = True
+
+    def stopped(self):
+        return self.stopping or stop_session
+
+    def use_graph(self, graph):
+        """switches the manager to another graph, or back to its own graph if 'graph' is None"""
+        with self.lock:
+            self.graph = graph if graph is not None else self.owned_graph
+
+    def check_graph(self, stats=None, sync=True):
+        """returns the manager's graph, allocating it or syncing the graph the manager allocated"""
+        with self.lock:
+            if self.graph is None:
+                self.graph = self.owned_graph = mpr.Graph()
+                register_manager(self)
+            elif self.graph is not self.owned_graph:
+                return self.graph
+            if sync:
+                logger.info('syncing graph...')
+                result = sync_graph(self.graph)
+                if stats is not None:
+                    stats.sync = result
+            return self.graph
+
+    def finish(self, stats):
+        stats.finish()
+        self.latest_stats = stats
+
+    def last_stats(self):
+        """returns the timings and counts of the manager's most recent load, unload, save or clear"""
+        return self.latest_stats
+
+    def get_sig_index(self):
+        """returns the signal index for the graph, building it if the graph hasn't been indexed yet"""
+        with self.lock:
+            if self.sig_index is None or self.sig_index.graph is not self.graph:
+                if self.sig_index is not None:
+                    self.sig_index.close()
+                self.sig_index = SignalIndex(self.graph)
+            return self.sig_index
+
+    def get_tag_index(self):
+        """returns the session tag index for the graph, building it if the graph hasn't been indexed yet"""
+        with self.lock:
+            if self.tag_index is None or self.tag_index.graph is not self.graph:
+                if self.tag_index is not None:
+                    self.tag_index.close()
+                self.tag_index = SessionTagIndex(self.graph)
+            return self.tag_index
+
+    def update_tag_index(self, map):
+        """updates the session tag index after changing a map's tags, if the graph has been indexed"""
+        if self.tag_index is not None and self.tag_index.graph is self.graph:
+            self.tag_index.update_map(map)
+
+    def save(self, filename="", description="", values=[], view_name="", views=[], compact=False, stream=False,
+             tables=False, devices=None, signals=None, tag=None, incremental=False):
+        """saves the current mapping state as a JSON session file, see mappersession.save()"""
+
+        stats = SessionStats("save")
+
+        # Create JSON from network state following the schema
+        session = {}
+        session["fileversion"] = current_fileversion
+        session["description"] = description.strip("'")
+        session["values"] = values
+        session["views"] = views
+
+        with self.lock:
+            with stats.phase("sync"):
+                graph = self.check_graph(stats)
+
+            # Populate maps
+            logger.info("Collecting maps from network...")
+            filename = filename.strip("'")
+            previous = None
+            if incremental and filename != "":
+                with stats.phase("previous"):
+                    previous = previous_maps(filename)
+            with stats.phase("filter"):
+                selected = self.select_maps(devices, signals, tag)
+            maps = self.collect_maps(session_name(filename) if filename != "" else None, stats, selected, previous)
+            if not stream or filename == "" or tables:
+                with stats.phase("collect"):
+                    maps = list(maps)
+                session["maps"] = maps
+            records = maps if isinstance(maps, list) else None
+            if tables:
+                session = encode_tables(session)
+                maps = session["maps"]
+            session["fileversion"] = session_fileversion(session)
+
+            # Save into the file
+            if filename != "":
+                # when streaming, collecting the maps is included in the write phase
+                with stats.phase("write"), replace_session_file(filename) as f:
+                    write_session(f, session, maps, None if compact else 4)
+                logger.info("Saved session as: %s", filename)
+                path = os.path.abspath(filename)
+                if records is not None:
+                    stat = os.stat(filename)
+                    saved_sessions[path] = ((stat.st_mtime_ns, stat.st_size), map_records(records))
+                else:
+                    saved_sessions.pop(path, None)
+
+            graph.poll()
+        self.finish(stats)
+        return session
+
+    # Returns the maps on the graph that match all of the given save() filters, or None for all maps
+    # Each filter only visits the maps of the matching devices, signals or tag rather than the whole graph
+    def select_maps(self, devices=None, signals=None, tag=None):
+        selections = []
+        if tag is not None:
+            selections.append({map["id"]: map for map in self.get_tag_index().tagged(tag)})
+        if devices is not None:
+            if isinstance(devices, str):
+                devices = [devices]
+            maps = {}
+            for dev_name in devices:
+                for dev in self.graph.devices().filter(mpr.Property.NAME, dev_name):
+                    maps.update((map["id"], map) for map in dev.maps())
+            selections.append(maps)
+        if signals is not None:
+            if isinstance(signals, str):
+                signals = [signals]
+            prefixes = tuple(signals)
+            maps = {}
+            for sig_name, sigs in self.get_sig_index().signals.items():
+                for dev_name, sig in sigs.items():
+                    if (dev_name + "/" + sig_name).startswith(prefixes):
+                        maps.update((map["id"], map) for map in sig.maps())
+            selections.append(maps)
+        if not selections:
+            return None
+        selected = min(selections, key=len)
+        return [map for id, map in selected.items() if all(id in maps for maps in selections)]
+
+    # Generates session map records for the maps on the graph, tagging the maps with 'name' if provided
+    # 'maps' limits the maps visited, see select_maps(). Records in 'previous' with the same id and version
+    # as the map on the graph are reused instead of being built again.
+    def collect_maps(self, name=None, stats=None, maps=None, previous=None):
+        if maps is None:
+            maps = self.graph.maps()
+        for map in maps:
+
+            if not is_saved_map(map):
+                if stats is not None:
+                    stats.count("skipped")
+                continue
+
+            newMap = map_signal_names(map)
+            record = previous.get(map_record_key(newMap)) if previous else None
+            # a map that was released and created again can have the same version, so the id must match too
+            if (record is not None and record.get("version") is not None and record["version"] == map["version"]
+                    and record.get("id") == map["id"]):
+                newMap = dict(record)
+                if stats is not None:
+                    stats.count("reused")
+            else:
+                add_map_properties(newMap, map)
+
+            # only push maps that don't have the tag yet, so unchanged maps keep their version
+            tags = map['session'] if name is not None else name
+            if name is not None and not (tags == name or isinstance(tags, list) and name in tags):
+                if tags is None:
+                    tags = name
+                elif isinstance(tags, list):
+                    tags.append(name)
+                else:
+                    tags = [tags, name]
+                map['session'] = tags
+                map.push()
+                self.update_tag_index(map)
+
+            if stats is not None:
+                stats.count("maps")
+            yield newMap
+
+    def stage_maps(self, maps, options={}, deadline=None, persist=False):
+        """adds maps to the staging list; they will be tried on the next staging iteration
+
+        'options' are keyword arguments for try_make_maps() used when creating the maps. Maps that
+        haven't been created by 'deadline' (a time.monotonic() time) are unstaged, and 'persist' keeps
+        maps staged after they have been created. Returns a handle for each map, see list_staged().
+        """
+        handles = []
+        with self.lock:
+            for map in maps:
+                staged = StagedMap(next(self.staging_handles), map, options, None if persist else deadline, persist)
+                self.staged_maps[staged.handle] = staged
+                if staged.deadline is not None:
+                    heapq.heappush(self.staging_deadlines, (staged.deadline, staged.handle))
+                for name in endpoint_sig_names(map):
+                    self.staged_by_sig.setdefault(name, {})[staged.handle] = staged
+                    self.new_sig_names.add(name)
+                handles.append(staged.handle)
+        return handles
+
+    def unstage_map(self, handle):
+        """removes a map from the staging list, returning False if it wasn't staged"""
+        with self.lock:
+            staged = self.staged_maps.pop(handle, None)
+            if staged is None:
+                return False
+            for name in endpoint_sig_names(staged.map):
+                maps = self.staged_by_sig.get(name)
+                if maps is None:
+                    continue
+                maps.pop(handle, None)
+                if not maps:
+                    del self.staged_by_sig[name]
+            # drop stale heap entries once they outnumber the staged maps
+            if len(self.staging_deadlines) > 2 * len(self.staged_maps) + 64:
+                self.staging_deadlines[:] = [(staged.deadline, staged.handle) for staged in self.staged_maps.values()
+                                             if staged.deadline is not None]
+                heapq.heapify(self.staging_deadlines)
+            return True
+
+    def list_staged(self):
+        """returns the maps that are staged waiting for their signals, see mappersession.list_staged()"""
+        now = time.monotonic()
+        with self.lock:
+            return [{"handle": staged.handle, "sources": staged.map["sources"],
+                     "destinations": staged.map["destinations"], "session": staged.map.get("session"),
+                     "expires": None if staged.deadline is None else max(0.0, staged.deadline - now),
+                     "persist": staged.persist}
+                    for staged in self.staged_maps.values()]
+
+    def cancel_staged(self, handle):
+        """stops waiting for a staged map, see mappersession.cancel_staged()"""
+        return self.unstage_map(handle)
+
+    def extend_staged(self, handle, seconds):
+        """changes how long a staged map waits for its signals, see mappersession.extend_staged()"""
+        with self.lock:
+            staged = self.staged_maps.get(handle)
+            if staged is None:
+                return False
+            staged.deadline = None if seconds is None else time.monotonic() + seconds
+            if staged.deadline is not None:
+                heapq.heappush(self.staging_deadlines, (staged.deadline, handle))
+            return True
+
+    # Unstages the maps whose deadline has passed, returning the next deadline or None
+    def expire_staged(self, now):
+        with self.lock:
+            while self.staging_deadlines:
+                deadline, handle = self.staging_deadlines[0]
+                staged = self.staged_maps.get(handle)
+                if staged is not None and staged.deadline == deadline and deadline > now:
+                    return deadline
+                # pop before unstaging, which may rebuild the heap
+                heapq.heappop(self.staging_deadlines)
+                if staged is not None and staged.deadline == deadline:
+                    logger.debug('removing expired map')
+                    self.unstage_map(handle)
+        return None
+
+    def staged_maps_for_sigs(self, names):
+        """returns the staged maps with a source or destination signal in 'names'"""
+        maps = {}
+        with self.lock:
+            for name in names:
+                maps.update(self.staged_by_sig.get(name, {}))
+        return list(maps.values())
+
+    # Tries to create staged maps, unstaging those that were created unless they persist
+    # Maps staged together share their options, so each group is created with a single try_make_maps()
+    # call that pushes all of its maps and verifies them together
+    def retry_staged(self, staged_maps):
+        groups = {}
+        for staged in staged_maps:
+            groups.setdefault(id(staged.options), []).append(staged)
+        for group in groups.values():
+            report = self.try_make_maps([staged.map for staged in group], **group[0].options)
+            created = {id(map) for map in report["created"]}
+            failed = {id(map) for map in report["failed"] + report["timed_out"]}
+            for staged in group:
+                if id(staged.map) in created:
+                    staged.retry_delay = None
+                    if not staged.persist:
+                        logger.debug('removing new map from staged maps')
+                        self.unstage_map(staged.handle)
+                elif id(staged.map) in failed:
+                    # no new signal may appear to try it again, so retry it after a growing delay
+                    if staged.retry_delay is None:
+                        staged.retry_delay = staging_retry_delay
+                    else:
+                        staged.retry_delay = min(staged.retry_delay * 2, staging_max_retry_delay)
+                    heapq.heappush(self.staging_retries, (time.monotonic() + staged.retry_delay, staged.handle))
+
+    # Marks the signals of staged maps whose retry time has passed as new, so they are tried again
+    def due_retries(self, now):
+        with self.lock:
+            while self.staging_retries and self.staging_retries[0][0] <= now:
+                retry, handle = heapq.heappop(self.staging_retries)
+                staged = self.staged_maps.get(handle)
+                if staged is not None:
+                    self.new_sig_names.update(endpoint_sig_names(staged.map))
+
+    # Graph callback used while staging: remember newly announced signals so that only the staged maps
+    # that use them are retried
+    def on_staging_event(self, type, obj, event):
+        if event == mpr.Graph.Event.NEW:
+            self.new_sig_names.add(obj[mpr.Property.NAME])
+
+    # Internal staging method to be used in a thread
+    # maps that should be staged should be added with stage_maps()
+    # Polls wake up at the next staging deadline, so maps expire on time. The graph is only polled
+    # and used while holding the lock, so other threads can use the manager between polls.
+    def wait_for_sigs(self):
+        graph = self.graph
+        add_graph_handler(graph, self.on_staging_event, mpr.Type.SIGNAL)
+        deadline = None
+        try:
+            while not self.stopped():
+                with self.lock:
+                    if not self.staged_maps:
+                        # checked under the lock so that load_maps() starts a new thread for later maps
+                        if self.staging_thread is threading.current_thread():
+                            self.staging_thread = None
+                        break
+                # Try to create any staged maps that we can
+                try:
+                    wait = 50 if deadline is None else min(50, math.ceil((deadline - time.monotonic()) * 1000))
+                    with self.lock:
+                        self.graph.poll(max(wait, 0))
+                        self.due_retries(time.monotonic())
+                        if self.new_sig_names:
+                            names = self.new_sig_names.copy()
+                            self.new_sig_names.clear()
+                            self.retry_staged(self.staged_maps_for_sigs(names))
+                        deadline = self.expire_staged(time.monotonic())
+                        # also wake up for the next retry
+                        if self.staging_retries and (deadline is None or self.staging_retries[0][0] < deadline):
+                            deadline = self.staging_retries[0][0]
+                except Exception as err:
+                    logger.debug("error while staging maps: %s", err)
+        finally:
+            with self.lock:
+                if self.staging_thread is threading.current_thread():
+                    self.staging_thread = None
+            remove_graph_handler(self.on_staging_event)
+
+    # Attempts to create any eligible maps that have all sources and destination present
+    # Maps are built first, pushed together and then polled until they are active or 'timeout' seconds
+    # have passed. Returns a report dict listing the session maps that were 'created', 'failed' or
+    # 'timed_out', with one entry per libmapper map.
+    # If 'reconcile' is True maps that already exist are not recreated: only properties that differ are
+    # pushed and the maps are reported as 'updated' or 'unchanged'. If 'release' is also True, existing
+    # maps that are not part of 'maps' are released and reported as 'released'.
+    # Without a device_map, 'match' selects which of the wildcard-matched signals are combined into maps
+    # (see match_signals) and 'max_fanout' limits the number of maps created for each session map.
+    # Timings and failures are added to 'stats' if it is provided.
+    def try_make_maps(self, maps, device_map=None, timeout=1.0, reconcile=False, release=False, match="all",
+                      max_fanout=256, stats=None):
+
+        if stats is None:
+            stats = SessionStats("try_make_maps")
+        with self.lock:
+            report, pending = self.create_maps(maps, device_map, reconcile, release, match, max_fanout, stats)
+
+            # Wait for the maps to become active
+            with stats.phase("verify"):
+                deadline = time.monotonic() + timeout
+                while pending:
+                    self.graph.poll(10 if timeout > 0 else 0)
+                    pending = self.check_maps(pending, report)
+                    if time.monotonic() >= deadline:
+                        break
+                expire_maps(pending, report, stats)
+        stats.add_report(report)
+        return report
+
+    # Creates and pushes the maps for try_make_maps() without waiting for them
+    # Returns the report and a list of pending maps to pass to check_maps()
+    def create_maps(self, maps, device_map=None, reconcile=False, release=False, match="all", max_fanout=256,
+                    stats=None):
+
+        if stats is None:
+            stats = SessionStats("create_maps")
+        start = time.perf_counter()
+        graph = self.graph
+        index = self.get_sig_index()
+        report = {"created": [], "failed": [], "timed_out": [], "updated": [], "unchanged": [], "released": []}
+        pending = []
+        existing = {}
+        if reconcile:
+            for map in graph.maps():
+                if any([sig.device()["hidden"] for sig in map.signals()]):
+                    continue
+                existing[map_key(map.signals(mpr.Map.Location.SOURCE), map.signals(mpr.Map.Location.DESTINATION)[0])] = map
+        matched = set()
+        find = signal_finder(graph, device_map, index)
+        for map in maps:
+            # Check if the map's signals are available
+            # Match signals with different device names for mapping transportability
+
+            srcs = [find(s) for s in map["sources"]]
+            dsts = find(map["destinations"][0])
+
+            for count, (src_list, dst) in enumerate(match_signals(map, srcs, dsts, match)):
+                if max_fanout is not None and count >= max_fanout:
+                    logger.warning("map %s -> %s matches more than %d signal combinations, skipping the rest",
+                                   map["sources"], map["destinations"], max_fanout)
+                    break
+                if reconcile:
+                    key = map_key(src_list, dst)
+                    if key in existing:
+                        matched.add(key)
+                        if set_map_properties(existing[key], map, src_list, dst, index, only_changed=True):
+                            existing[key].push()
+                            self.update_tag_index(existing[key])
+                            report["updated"].append(map)
+                        else:
+                            report["unchanged"].append(map)
+                        self.own_map(existing[key], map, src_list, dst)
+                        continue
+
+                # Create map
+                new_map = mpr.Map(list(src_list), dst)
+                if not new_map:
+                    stats.fail("failed to create map {0} -> {1}".format(map["sources"], map["destinations"]))
+                    report["failed"].append(map)
+                    continue
+                set_map_properties(new_map, map, src_list, dst, index)
+                pending.append((map, new_map, src_list, dst))
+        stats.add_time("match", time.perf_counter() - start)
+        start = time.perf_counter()
+
+        # Release existing maps that aren't part of the session
+        if release:
+            for key, map in existing.items():
+                # Only remove if mappersession isn't the destination
+                if key in matched or "mappersession" in key[1].split('/', 1)[0]:
+                    continue
+                logger.debug("  releasing map: %s -> %s", list(key[0]), key[1])
+                map.release()
+                if self.tag_index is not None and self.tag_index.graph is graph:
+                    self.tag_index.remove_map(map)
+                report["released"].append(map)
+
+        # Push to network
+        for map, new_map, src_list, dst in pending:
+            new_map.push()
+            self.own_map(new_map, map, src_list, dst)
+        stats.add_time("push", time.perf_counter() - start)
+        return report, pending
+
+    # Adds the pending maps that have become active to the report, returns the maps still pending
+    def check_maps(self, pending, report):
+        waiting = []
+        for map, new_map, src_list, dst in pending:
+            if new_map.ready:
+                self.update_tag_index(new_map)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("created map: %s -> %s", [s['name'] for s in new_map.signals(mpr.Map.Location.SOURCE)],
+                                 [s['name'] for s in new_map.signals(mpr.Map.Location.DESTINATION)])
+                report["created"].append(map)
+            else:
+                waiting.append((map, new_map, src_list, dst))
+        return waiting
+
+    # Records that a session owns a libmapper map, along with the session map's desired properties
+    def own_map(self, new_map, map, src_list, dst):
+        name = map.get('session')
+        if name is None:
+            return
+        key = map_key(src_list, dst)
+        entry = self.map_owners.setdefault(key, {"map": new_map, "owners": []})
+        entry["map"] = new_map
+        entry["owners"] = [owner for owner in entry["owners"] if owner["session"] != name]
+        entry["owners"].append({"session": name, "map": map, "sources": list(src_list), "destination": dst})
+        self.session_map_keys.setdefault(name, set()).add(key)
+        self.owned_map_keys[new_map['id']] = key
+        add_graph_handler(self.graph, self.on_owned_map_event, mpr.Type.MAP)
+
+    # Graph callback that forgets the owners of maps that have been removed from the network
+    def on_owned_map_event(self, type, obj, event):
+        if event == mpr.Graph.Event.REMOVED or event == mpr.Graph.Event.EXPIRED:
+            key = self.owned_map_keys.pop(obj['id'], None)
+            if key is not None:
+                self.disown_map(key)
+
+    def disown_map(self, key):
+        entry = self.map_owners.pop(key, None)
+        if entry is None:
+            return
+        for owner in entry["owners"]:
+            keys = self.session_map_keys.get(owner["session"])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.session_map_keys[owner["session"]]
+
+    def start_session(self, filenames, device_map=None, match="all", max_fanout=256):
+        """start an interactive session, see mappersession.start_session()"""
+
+        graph = self.check_graph(sync=False)
+        install_stop_handlers()
+        self.stopping = False
+
+        if not isinstance(filenames, list):
+            filenames = [filenames]
+        with self.lock:
+            self.session_filenames = filenames
+            self.session_plan_options = {"device_map": compile_device_map(device_map), "match": match,
+                                         "max_fanout": max_fanout}
+
+            # Set up libmapper signal that controls the current session index
+            dev = mpr.Device("mappersession", graph)
+            for filename in self.session_filenames:
+                signame = session_name(filename)
+                # TODO: need to handle duplicate filenames?
+                sig = dev.add_signal(mpr.Signal.Direction.INCOMING, signame, 1, mpr.Type.INT32,
+                                     None, 0, 1, None)
+                sig.set_property("filename", filename, publish=False)
+                sig.set_callback(self.cur_session_handler, mpr.Signal.Event.REMOTE_UPDATE)
+                self.plan_session(filename, **self.session_plan_options)
+
+        while (not self.stopped()):
+            with self.lock:
+                dev.poll(50)
+                # Keep the plans up to date with the graph between switches
+                for filename in self.session_filenames:
+                    self.plan_session(filename, **self.session_plan_options)
+
+        with self.lock:
+            dev.free()
+            if graph is self.owned_graph:
+                self.close()
+
+    def cur_session_handler(self, sig, event, id, val, time):
+        filename = sig['filename']
+        try:
+            self.switch_session(filename, val != 0, **self.session_plan_options)
+        except Exception as err:
+            logger.error('error switching session %s: %s', filename, err)
+
+    def plan_session(self, filename, device_map=None, match="all", max_fanout=256):
+        """returns the resolved plan for loading a session file, see mappersession.plan_session()"""
+        with self.lock:
+            index = self.get_sig_index()
+            stat = os.stat(filename)
+            file_key = (stat.st_mtime_ns, stat.st_size)
+            options = (device_map, match, max_fanout)
+            plan = self.session_plans.get(filename)
+            if plan is None or plan["file_key"] != file_key:
+                session_json = prepare_file(filename, validated_files.get(filename) != file_key)
+                if session_json is None:
+                    self.session_plans.pop(filename, None)
+                    return None
+                validated_files[filename] = file_key
+                plan = {"file_key": file_key, "session": session_json, "index": None, "version": None, "options": None}
+                self.session_plans[filename] = plan
+            if plan["index"] is not index or plan["version"] != index.version or plan["options"] != options:
+                maps = []
+                find = signal_finder(self.graph, device_map, index)
+                for map in plan["session"]["maps"]:
+                    srcs = [find(s) for s in map["sources"]]
+                    dsts = find(map["destinations"][0])
+                    for count, (src_list, dst) in enumerate(match_signals(map, srcs, dsts, match)):
+                        if max_fanout is not None and count >= max_fanout:
+                            break
+                        maps.append((map, src_list, dst, map_key(src_list, dst),
+                                     resolve_map_properties(map, src_list, dst, index)))
+                plan.update(maps=maps, index=index, version=index.version, options=options)
+            return plan
+
+    def switch_session(self, filename, active, device_map=None, match="all", max_fanout=256):
+        """loads or unloads a session file using its precomputed plan, see mappersession.switch_session()"""
+        if not active:
+            self.unload(filename, sync=False)
+            return None
+        with self.lock:
+            plan = self.plan_session(filename, device_map, match, max_fanout)
+            if plan is None:
+                return None
+            name = session_name(filename)
+            index = plan["index"]
+            report = {"created": [], "failed": [], "timed_out": [], "updated": [], "unchanged": [], "released": []}
+            pushed = []
+            for map, src_list, dst, key, resolved in plan["maps"]:
+                entry = self.map_owners.get(key)
+                if entry is not None:
+                    owner = entry["owners"][-1]
+                    if owner["session"] == name and owner["map"] is map:
+                        report["unchanged"].append(map)
+                        continue
+                    new_map = entry["map"]
+                    if set_map_properties(new_map, map, src_list, dst, index, only_changed=True, resolved=resolved):
+                        pushed.append((map, new_map, src_list, dst))
+                        report["updated"].append(map)
+                    else:
+                        report["unchanged"].append(map)
+                    self.own_map(new_map, map, src_list, dst)
+                    continue
+                new_map = mpr.Map(list(src_list), dst)
+                if not new_map:
+                    logger.error("failed to create map %s -> %s", map["sources"], map["destinations"])
+                    report["failed"].append(map)
+                    continue
+                set_map_properties(new_map, map, src_list, dst, index, resolved=resolved)
+                pushed.append((map, new_map, src_list, dst))
+                report["created"].append(map)
 
-def save(filename="", description="", values=[], view_name="", views=[], graph=None):
+            for map, new_map, src_list, dst in pushed:
+                new_map.push()
+                self.own_map(new_map, map, src_list, dst)
+        logger.info("switched to session '%s': %d maps created, %d updated, %d unchanged",
+                    name, len(report["created"]), len(report["updated"]), len(report["unchanged"]))
+        return report
+
+    def load(self, filename, interactive=False, wait=False, persist=False, background=False, device_map=None,
+             validate=True, reconcile=False, release=False, workers=None, match="all", max_fanout=256, until=None):
+        """loads session files, see mappersession.load()"""
+
+        if interactive:
+            return self.start_session(filename, device_map, match, max_fanout)
+
+        stats = SessionStats("load")
+        if not isinstance(filename, list):
+            filename = [filename]
+        views = []
+        values = []
+        maps = []
+
+        # Skip validation of files that are unchanged since they last passed
+        file_keys = {}
+        for name in filename:
+            stat = os.stat(name)
+            file_keys[name] = (stat.st_mtime_ns, stat.st_size)
+        validate_files = [validate and validated_files.get(name) != file_keys[name] for name in filename]
+
+        # Journals are replayed up to 'until', so they are neither cached nor remembered as validated
+        sessions = [None] * len(filename)
+        journals = [i for i, name in enumerate(filename) if is_journal_filename(name)]
+        for i in journals:
+            with stats.phase("replay"):
+                session_json = replay_journal(filename[i], until)
+            sessions[i] = prepare_json(session_json, filename[i], validate, stats)
+            validate_files[i] = False
+        others = [i for i in range(len(filename)) if i not in journals]
+
+        # Use prepared sessions from the persistent cache, and only prepare the others
+        if session_cache is not None:
+            with stats.phase("cache"):
+                for i in others:
+                    sessions[i] = session_cache.get(filename[i], validate_files[i])
+            stats.count("cache_hits", len([i for i in others if sessions[i] is not None]))
+        misses = [i for i in others if sessions[i] is None]
+
+        with self.lock:
+            # Parse, upgrade and validate the files in worker processes while the graph is syncing. Starting
+            # workers re-imports libmapper and jsonschema in each, so this only pays off for large files
+            # and is opt-in
+            if workers is None:
+                workers = 1
+            workers = min(workers, len(misses))
+            if workers > 1:
+                context = multiprocessing.get_context("spawn")
+                with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as executor:
+                    futures = executor.map(prepare_file_with_stats, [filename[i] for i in misses],
+                                           [validate_files[i] for i in misses], itertools.repeat(session_cache))
+                    with stats.phase("sync"):
+                        self.check_graph(stats)
+                    for i, (session_json, file_stats) in zip(misses, futures):
+                        stats.merge(file_stats)
+                        sessions[i] = session_json
+            else:
+                with stats.phase("sync"):
+                    self.check_graph(stats)
+                for i in misses:
+                    sessions[i] = prepare_file(filename[i], validate_files[i], stats, session_cache, use_cache=False)
+
+            for name, validate_file, session_json in zip(filename, validate_files, sessions):
+                if session_json is None:
+                    continue
+                if validate_file:
+                    validated_files[name] = file_keys[name]
+                views.extend(session_json["views"])
+                values.extend(session_json["values"])
+                maps.extend(session_json["maps"])
+
+            # Create the maps from all files together
+            self.load_maps(maps, wait, persist, background, device_map, reconcile, release, match, max_fanout, stats)
+        self.finish(stats)
+        return views, values
+
+    def load_json(self, session_json, name=None, wait=False, persist=False, background=False, device_map=None,
+                  validate=True, reconcile=False, release=False, match="all", max_fanout=256):
+        """loads a session JSON Dict, see mappersession.load_json()"""
+
+        stats = SessionStats("load")
+        with self.lock:
+            with stats.phase("sync"):
+                self.check_graph(stats)
+
+            session_json = prepare_json(session_json, name, validate, stats)
+            if session_json is None:
+                self.finish(stats)
+                return None, None
+
+            self.load_maps(session_json["maps"], wait, persist, background, device_map, reconcile, release, match,
+                           max_fanout, stats)
+
+        self.finish(stats)
+        return session_json["views"], session_json["values"]
+
+    # Creates or stages the maps of prepared sessions
+    def load_maps(self, maps, wait=False, persist=False, background=False, device_map=None, reconcile=False,
+                  release=False, match="all", max_fanout=256, stats=None):
+
+        if stats is None:
+            stats = SessionStats("load")
+        if match not in match_policies:
+            stats.fail("unknown match policy '{0}', expected one of {1}".format(match, match_policies))
+            return
+        try:
+            device_map = compile_device_map(device_map)
+        except ValueError as err:
+            stats.fail(str(err))
+            return
+        stats.count("session_maps", len(maps))
+
+        if wait or persist:
+            if wait == True:
+                deadline = None
+            elif wait == False or wait <= 0:
+                deadline = time.monotonic()
+            else:
+                deadline = time.monotonic() + wait
+            if logger.isEnabledFor(logging.DEBUG):
+                for map in maps:
+                    logger.debug("staging map %s", map)
+            with self.lock:
+                self.stage_maps(maps, {"device_map": device_map, "match": match, "max_fanout": max_fanout},
+                                deadline, persist)
+                start = self.staging_thread == None
+                if start:
+                    self.stopping = False
+                if start and background:
+                    self.staging_thread = threading.Thread(target = self.wait_for_sigs, daemon = True)
+                    self.staging_thread.start()
+            stats.count("staged", len(maps))
+            if start and not background:
+                install_stop_handlers()
+                self.wait_for_sigs()
+        else:
+            report = self.try_make_maps(maps, device_map, reconcile=reconcile, release=release, match=match,
+                                        max_fanout=max_fanout, stats=stats)
+            print_report(report, len(maps))
+
+    def unload(self, filename, sync=True):
+        """unloads session files, see mappersession.unload()
+
+        :optional param sync (Boolean): Sync a graph allocated by the manager first, default True. The graph of an interactive session is kept up to date by polling, so switch_session() doesn't.
+        """
+
+        stats = SessionStats("unload")
+        with self.lock:
+            with stats.phase("sync"):
+                graph = self.check_graph(stats, sync)
+
+            start = time.perf_counter()
+            if not isinstance(filename, list):
+                filename = [filename]
+            names = {session_name(name) for name in filename}
+
+            index = self.get_sig_index()
+            restored = []
+            untagged = []
+            released = []
+            for key in set().union(*[self.session_map_keys.get(name, set()) for name in names]):
+                entry = self.map_owners[key]
+                map = entry["map"]
+                # the map may also be tagged by sessions loaded elsewhere, e.g. by another process
+                tags = [tag for tag in map_session_tags(map) if tag not in names]
+                owners = [owner for owner in entry["owners"] if owner["session"] not in names]
+                if not owners:
+                    self.owned_map_keys.pop(map['id'], None)
+                    self.disown_map(key)
+                    if tags:
+                        map['session'] = tags if len(tags) > 1 else tags[0]
+                        untagged.append(map)
+                    else:
+                        released.append(map)
+                    continue
+                for name in names:
+                    if key in self.session_map_keys.get(name, ()):
+                        self.session_map_keys[name].discard(key)
+                        if not self.session_map_keys[name]:
+                            del self.session_map_keys[name]
+                entry["owners"] = owners
+                owner = owners[-1]
+                set_map_properties(map, owner["map"], owner["sources"], owner["destination"], index, only_changed=True)
+                tags += [owner["session"] for owner in owners if owner["session"] not in tags]
+                map['session'] = tags if len(tags) > 1 else tags[0]
+                restored.append(map)
+            stats.add_time("match", time.perf_counter() - start)
+
+            # Apply all changes together
+            with stats.phase("push"):
+                for map in restored + untagged:
+                    map.push()
+                    self.update_tag_index(map)
+                for map in released:
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("  releasing map: %s -> %s", [s['name'] for s in map.signals(mpr.Map.Location.SOURCE)],
+                                     [s['name'] for s in map.signals(mpr.Map.Location.DESTINATION)])
+                    map.release()
+                    if self.tag_index is not None and self.tag_index.graph is graph:
+                        self.tag_index.remove_map(map)
+                graph.poll()
+            stats.count("released", len(released))
+            stats.count("restored", len(restored))
+            stats.count("untagged", len(untagged))
+            logger.info("released %d maps, restored %d maps, untagged %d maps", len(released), len(restored),
+                        len(untagged))
+
+            # Clear any other maps with matching session tags, e.g. from sessions loaded by another process
+            for name in names:
+                self.clear_maps(name, stats)
+        self.finish(stats)
+        return stats
+
+    def clear(self, tag=None):
+        """clears maps on the network except for those connected to mappersession, see mappersession.clear()"""
+
+        stats = SessionStats("clear")
+        with self.lock:
+            with stats.phase("sync"):
+                self.check_graph(stats)
+            self.clear_maps(tag, stats)
+        self.finish(stats)
+        return stats
+
+    # Releases the maps for clear(), adding the number of released maps to 'stats'
+    def clear_maps(self, tag, stats):
+        start = time.perf_counter()
+        unloaded = 0
+        if tag:
+            logger.info("releasing maps with session tag '%s'", tag)
+            index = self.get_tag_index()
+            maps = index.tagged(tag)
+        else:
+            index = self.tag_index if self.tag_index is not None and self.tag_index.graph is self.graph else None
+            maps = self.graph.maps()
+        for map in maps:
+            dstSigs = map.signals(mpr.Map.Location.DESTINATION)
+            # Only remove if mappersession isn't the destination
+            if "mappersession" in dstSigs[0].device()[mpr.Property.NAME]:
+                continue
+            if tag:
+                tags = map['session']
+                if isinstance(tags, list) and len(tags) > 1:
+                    # remove session tag from list and continue without removing
+                    tags.remove(tag)
+                    map['session'] = tags
+                    map.push()
+                    index.update_map(map)
+                    stats.count("untagged")
+                    continue
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("  releasing map: %s -> %s", [s['name'] for s in map.signals(mpr.Map.Location.SOURCE)],
+                             [s['name'] for s in map.signals(mpr.Map.Location.DESTINATION)])
+            map.release()
+            if index is not None:
+                index.remove_map(map)
+            unloaded += 1
+        self.graph.poll()
+        stats.add_time("push", time.perf_counter() - start)
+        stats.count("released", unloaded)
+        logger.info("released %d maps", unloaded)
+
+    def tags(self):
+        """returns the session tags of the maps on the network"""
+        with self.lock:
+            self.check_graph()
+            return list(self.get_tag_index().maps)
+
+    def tag_counts(self):
+        """returns the number of maps on the network with each session tag"""
+        with self.lock:
+            self.check_graph()
+            return self.get_tag_index().counts()
+
+# Managers by the id of their graph, see get_manager()
+managers = {}
+managers_lock = threading.Lock()
+# Manager used by the module functions for graphs without a registered manager
+default_manager = None
+
+def register_manager(manager):
+    with managers_lock:
+        managers[id(manager.graph)] = manager
+
+def unregister_manager(manager):
+    with managers_lock:
+        if managers.get(id(manager.graph)) is manager:
+            del managers[id(manager.graph)]
+
+def get_default_manager():
+    global default_manager
+    with managers_lock:
+        if default_manager is None:
+            default_manager = SessionManager()
+        return default_manager
+
+def get_manager(graph=None):
+    """returns the SessionManager that the module functions use for a graph
+
+    A graph passed to SessionManager() is managed by that manager. Other graphs, and calls without a
+    graph, use a default manager: it switches to a graph it is given, and to a graph of its own
+    (allocated once and synced before each operation) when it isn't given one. Session ownership
+    and staged maps are kept across these switches, as when the module used a single global state.
+
+    :optional param graph (libmapper Graph object): The graph, or None for the default manager's own graph
+    :return (SessionManager): The manager
+    """
+    if graph is not None:
+        with managers_lock:
+            manager = managers.get(id(graph))
+        if manager is not None and manager.graph is graph:
+            return manager
+    manager = get_default_manager()
+    manager.use_graph(graph)
+    return manager
+
+def save(filename="", description="", values=[], view_name="", views=[], graph=None, compact=False, stream=False,
+         tables=False, devices=None, signals=None, tag=None, incremental=False):
     """saves the current mapping state as a JSON session file.
 
-    :optional param filename (String): The JSON file to save the session into
+    :optional param filename (String): The JSON file to save the session into. Files ending in '.gz', '.bz2', '.xz' or '.zst' are compressed.
     :optional param description (String): A short description of the current session
     :optional param values (List): Array of signal {name, value} pairs to set on session load
     :optional param view_name (String): Name of the GUI that's adding metadata
     :optional param views (List): GUI related object for recreating the session
     :optional param graph (libmapper Graph object): A previously-allocated libmapper graph object to use. If not provided one will be allocated internally.
-    :return (Dict): The session JSON object
+    :optional param compact (Boolean): Write the file without indentation or extra whitespace, default False
+    :optional param stream (Boolean): Write maps to the file as they are collected instead of keeping them in memory, default False. The returned session will not include the maps.
+    :optional param tables (Boolean): Write device and signal tables and default map properties instead of repeating them in every map, default False. Maps can't be streamed in this format.
+    :optional param devices (List): Only save maps connected to these devices, default None
+    :optional param signals (List): Only save maps connected to signals whose full name ('device/signal') starts with one of these prefixes, default None
+    :optional param tag (String): Only save maps with this session tag, default None
+    :optional param incremental (Boolean): Reuse the records of maps whose version hasn't changed since they were saved to the existing file, default False
+    :return (Dict): The session JSON object, see last_stats() for timings
     """
+    return get_manager(graph).save(filename, description, values, view_name, views, compact, stream, tables,
+                                   devices, signals, tag, incremental)
 
-    # Create JSON from network state following the schema
-    session = {}
-    session["fileversion"] = current_fileversion
-    session["description"] = description.strip("'")
-    session["values"] = values
-    session["views"] = views
+def select_maps(graph, devices=None, signals=None, tag=None):
+    """returns the maps on the graph that match all of the given save() filters, or None for all maps"""
+    return get_manager(graph).select_maps(devices, signals, tag)
 
-    graph = check_graph(graph)
+def collect_maps(graph, name=None, stats=None, maps=None, previous=None):
+    """generates session map records for the maps on the graph, see SessionManager.collect_maps()"""
+    return get_manager(graph).collect_maps(name, stats, maps, previous)
 
-    # Populate maps
-    print("Collecting maps from network...")
-    session["maps"] = []
-    for map in graph.maps():
-
-        # omit 'hidden' devices and signals
-        if any([sig["hidden"] or sig.device()["hidden"] for sig in map.signals()]):
-            print("Skipping hidden device or signal")
-            continue
-
-        # omit maps with the tag 'no_save'
-        if (map['no_save']):
-            print("Skipping map with 'no_save' tag")
-            continue
-
-        newMap = {}
-        # Source signals
-        newMap["sources"] = [(sig.device()[mpr.Property.NAME] + "/" + sig[mpr.Property.NAME])
-                             for sig in map.signals(mpr.Map.Location.SOURCE)]
-
-        # Destination signals
-        newMap["destinations"] = [(sig.device()[mpr.Property.NAME] + "/" + sig[mpr.Property.NAME])
-                                  for sig in map.signals(mpr.Map.Location.DESTINATION)]
-
-        # Other properties
-        props = map.properties.copy()
-        for key in props:
-            val = props[key]
-            if key == "expr":
-                newMap["expression"] = val
-            if key == "process_loc":
-                newMap[key] = val.name
-            elif key == "protocol":
-                newMap[key] = val.name
-            elif key == "scope":
-                if val is not None:
-                    newMap[key] = [dev[mpr.Property.NAME] for dev in val]
-            elif key == "status":
-                newMap[key] = val.name
-            elif key == "is_local" or key == "num_sigs_in" or key == "session":
-                pass
-            else:
-                newMap[key] = val
+# Returns the map records of an existing session file keyed by map_record_key(), or {} if it can't be read
+def previous_maps(filename):
+    path = os.path.abspath(filename)
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return {}
+    file_key = (stat.st_mtime_ns, stat.st_size)
+    saved = saved_sessions.get(path)
+    if saved is not None and saved[0] == file_key:
+        return saved[1]
+    try:
+        with open_session_file(filename) as f:
+            session_json = upgrade_json(json.load(f), notify=False)
+            if session_json is not None:
+                session_json = decode_tables(session_json)
+    except (OSError, ValueError, KeyError, TypeError) as err:
+        logger.warning("could not read %s for an incremental save, saving all maps: %s", filename, err)
+        return {}
+    if session_json is None:
+        return {}
+    return map_records(session_json["maps"])
+
+def map_records(maps):
+    return {map_record_key(map): map for map in maps}
+
+# Returns a map's session tags as a list
+def map_session_tags(map):
+    tags = map['session']
+    if tags is None:
+        return []
+    return list(tags) if isinstance(tags, list) else [tags]
+
+def map_record_key(map):
+    return (tuple(map["sources"]), tuple(map["destinations"]))
+
+# Returns False for maps that are not saved: those with 'hidden' devices or signals or the 'no_save' tag
+def is_saved_map(map):
+    if any([sig["hidden"] or sig.device()["hidden"] for sig in map.signals()]):
+        logger.debug("Skipping hidden device or signal")
+        return False
+    if (map['no_save']):
+        logger.debug("Skipping map with 'no_save' tag")
+        return False
+    return True
+
+# Returns a session map record with the full names of a map's source and destination signals
+def map_signal_names(map):
+    return {"sources": [full_name(sig) for sig in map.signals(mpr.Map.Location.SOURCE)],
+            "destinations": [full_name(sig) for sig in map.signals(mpr.Map.Location.DESTINATION)]}
+
+# Adds the properties of a map to its session map record
+def add_map_properties(record, map):
+    props = map.properties.copy()
+    for key in props:
+        val = props[key]
+        if key == "expr":
+            record["expression"] = val
+        if key == "process_loc":
+            record[key] = val.name
+        elif key == "protocol":
+            record[key] = val.name
+        elif key == "scope":
+            if val is not None:
+                record[key] = [dev[mpr.Property.NAME] for dev in val]
+        elif key == "status":
+            record[key] = val.name
+        elif key == "is_local" or key == "num_sigs_in" or key == "session":
+            pass
+        else:
+            record[key] = val
+    return record
 
-        # Add to maps
-        session["maps"].append(newMap)
-
-        if filename != "":
-            name = filename.strip("'").removesuffix(".json").split('/')[-1]
-            tags = map['session']
-            if tags is not None:
-                if isinstance(tags, list):
-                    if name not in tags:
-                        tags.append(name)
-                elif tags != name:
-                    tags = [tags, name]
-            else:
-                tags = name
-            map['session'] = tags
-            map.push()
+def write_session(f, session, maps, indent=4):
+    """writes a session JSON object to a file, taking the maps from an iterable so they can be streamed
 
-    graph.poll()
+    :param f (File): A text file object to write to
+    :param session (Dict): The session JSON object, any 'maps' entry is ignored. Its fileversion is written as given by session_fileversion().
+    :param maps (Iterable): The session's maps
+    :optional param indent (Integer): Indentation to use, or None for compact output. Default 4
+    """
+    nl = "\n" if indent else ""
+    pad = " " * indent if indent else ""
+    item_sep, key_sep = (",", ": ") if indent else (",", ":")
+
+    def dumps(val, level):
+        text = json.dumps(val, ensure_ascii=False, indent=indent, separators=(item_sep, key_sep))
+        return text.replace("\n", "\n" + pad * level) if indent else text
+
+    f.write("{" + nl)
+    for key, val in session.items():
+        if key == "fileversion":
+            val = session_fileversion(session)
+        if key != "maps":
+            f.write(pad + json.dumps(key) + key_sep + dumps(val, 1) + item_sep + nl)
+    f.write(pad + '"maps"' + key_sep + "[")
+    empty = True
+    for map in maps:
+        f.write(("" if empty else item_sep) + nl + pad * 2 + dumps(map, 2))
+        empty = False
+    f.write(("]" if empty else nl + pad + "]") + nl + "}")
 
-    # Save into the file
-    if filename != "":
-        with open(filename.strip("'"), 'w', encoding='utf-8') as f:
-            json.dump(session, f, ensure_ascii=False, indent=4)
-            print("Saved session as: " + filename)
-    return session
+def session_fileversion(session):
+    """returns the fileversion to write for a current session: 2.5 if it uses tables, otherwise 2.4"""
+    if any(key in session for key in table_keys):
+        return current_fileversion
+    return plain_fileversion
 
-# Internal staging method to be used in a thread
-# maps that should be staged should be added to the global 'staged_maps'
-# TODO: add optional expiry for 'wait' argument, e.g. wait 10 seconds
-def wait_for_sigs():
-    global g, staged_maps
+def open_session_file(filename, mode='r'):
+    """opens a session file as text, (de)compressing it according to its extension
 
-    while not stop_session and (len(staged_maps)):
-        # Try to create any staged maps that we can
+    Supports '.gz', '.bz2' and '.xz' files, and '.zst' files if the 'zstandard' package is installed.
+    """
+    ext = os.path.splitext(filename)[1]
+    if ext == ".gz":
+        return gzip.open(filename, mode + 't', encoding='utf-8')
+    elif ext == ".bz2":
+        return bz2.open(filename, mode + 't', encoding='utf-8')
+    elif ext == ".xz":
+        return lzma.open(filename, mode + 't', encoding='utf-8')
+    elif ext == ".zst":
         try:
-            # TODO: don't bother running this unless new devices have appeared
-            g.poll(1000)
-            now = time.monotonic()
-            new_maps = try_make_maps(g, staged_maps, None)
-            for new_map in new_maps:
-                if 'persist' not in new_map:
-                    print('removing new map from staged maps')
-                    staged_maps.remove(new_map)
-
-            # Also check if any staged maps have expired
-            for staged_map in staged_maps:
-                if 'timeout' in staged_map:
-                    diff = now - staged_map['timeout']
-                    if diff > 0:
-                        print('removing expired map')
-                        staged_maps.remove(staged_map)
-        except:
-            pass
+            import zstandard
+        except ImportError:
+            raise ImportError("the 'zstandard' package is required for .zst session files")
+        return zstandard.open(filename, mode + 't', encoding='utf-8')
+    return open(filename, mode, encoding='utf-8')
+
+# Writes a session file through a temporary file next to it, which replaces the file once it is complete,
+# so a failed write leaves the previous file in place. Yields the open temporary file.
+@contextlib.contextmanager
+def replace_session_file(filename):
+    directory, name = os.path.split(os.path.abspath(filename))
+    fd, temp_name = tempfile.mkstemp(suffix=os.path.splitext(name)[1], prefix="." + name + ".", dir=directory)
+    os.close(fd)
+    try:
+        try:
+            mode = os.stat(filename).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o666 & ~file_umask
+        with open_session_file(temp_name, 'w') as f:
+            yield f
+        os.chmod(temp_name, mode)
+        os.replace(temp_name, filename)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+def session_name(filename):
+    """returns the session tag for a session file: its name without directories or extensions"""
+    name = filename.strip("'").split('/')[-1]
+    for ext in compressed_extensions:
+        name = name.removesuffix(ext)
+    return name.removesuffix(".json").removesuffix(journal_extension)
+
+# Seconds before a staged map that failed or timed out is tried again, doubling up to the maximum
+staging_retry_delay = 0.1
+staging_max_retry_delay = 5.0
+
+class StagedMap:
+    """A session map waiting for its signals to appear, see stage_maps()"""
+    __slots__ = ("handle", "map", "options", "deadline", "persist", "retry_delay")
+
+    def __init__(self, handle, map, options, deadline, persist):
+        self.handle = handle
+        self.map = map
+        # keyword arguments for try_make_maps()
+        self.options = options
+        # time.monotonic() time at which the map is unstaged, or None to wait indefinitely
+        self.deadline = deadline
+        # keep the map staged after it has been created, so it is recreated if its signals reappear
+        self.persist = persist
+        # seconds until the last failed attempt is tried again, None if it hasn't failed
+        self.retry_delay = None
+
+def list_staged(graph=None):
+    """returns the maps that are staged waiting for their signals
+
+    :optional param graph (libmapper Graph object): The graph whose manager staged the maps, default the default manager, see get_manager()
+    :return (List): A Dict for each staged map with its 'handle', 'sources', 'destinations', 'session'
+        tag, the 'expires' seconds until it is unstaged (None if it waits indefinitely) and 'persist'
+    """
+    return staging_manager(graph).list_staged()
 
-# Attempts to create any eligible maps that have all sources and destination present 
-def try_make_maps(graph, maps, device_map=None):
+def cancel_staged(handle, graph=None):
+    """stops waiting for a staged map
 
-    now = time.monotonic()
-    new_maps = []
-    for map in maps:
-        # Check if the map's signals are available
-        # Match signals with different device names for mapping transportability
-        
-        srcs = [find_sigs(graph, s, device_map) for s in map["sources"]]
-        src_list_list = list(itertools.product(*srcs))
-        dsts = find_sigs(graph, map["destinations"][0], device_map)
+    :param handle (Integer): The handle of the staged map, see list_staged()
+    :optional param graph (libmapper Graph object): The graph whose manager staged the map
+    :return (Boolean): False if the map was no longer staged
+    """
+    return staging_manager(graph).cancel_staged(handle)
+
+def extend_staged(handle, seconds, graph=None):
+    """changes how long a staged map waits for its signals
 
+    :param handle (Integer): The handle of the staged map, see list_staged()
+    :param seconds (Float): Seconds to wait from now, or None to wait indefinitely
+    :optional param graph (libmapper Graph object): The graph whose manager staged the map
+    :return (Boolean): False if the map was no longer staged
+    """
+    return staging_manager(graph).extend_staged(handle, seconds)
+
+# Staging handles belong to a manager: without a graph use the default manager without switching its graph
+def staging_manager(graph):
+    return get_manager(graph) if graph is not None else get_default_manager()
+
+def endpoint_sig_names(map):
+    """returns the signal names (without device names) of a session map's endpoints"""
+    return {name.split('/', 1)[-1] for name in map["sources"] + map["destinations"]}
+
+def try_make_maps(graph, maps, device_map=None, timeout=1.0, reconcile=False, release=False, match="all",
+                  max_fanout=256, stats=None):
+    """creates the session maps whose signals are present on the graph, see SessionManager.try_make_maps()"""
+    return get_manager(graph).try_make_maps(maps, device_map, timeout, reconcile, release, match, max_fanout, stats)
+
+def create_maps(graph, maps, device_map=None, reconcile=False, release=False, match="all", max_fanout=256,
+                stats=None):
+    """creates and pushes maps without waiting for them, see SessionManager.create_maps()"""
+    return get_manager(graph).create_maps(maps, device_map, reconcile, release, match, max_fanout, stats)
+
+def check_maps(graph, pending, report):
+    """adds the pending maps that have become active to the report, returns the maps still pending"""
+    return get_manager(graph).check_maps(pending, report)
+
+# Reports maps that are still pending as timed out
+def expire_maps(pending, report, stats=None):
+    for map, new_map, src_list, dst in pending:
+        message = "timed out waiting for map {0} -> {1}".format(map["sources"], map["destinations"])
+        if stats is not None:
+            stats.fail(message)
+        else:
+            logger.error(message)
+        report["timed_out"].append(map)
+
+def print_report(report, num_maps):
+    """prints a summary of a try_make_maps() report for a session with 'num_maps' maps"""
+    loaded = len({id(map) for map in report["created"]})
+    logger.info("loaded %d/%d maps (%d failed, %d timed out)", loaded, num_maps, len(report["failed"]),
+                len(report["timed_out"]))
+    if report["updated"] or report["unchanged"] or report["released"]:
+        logger.info("reconciled %d existing maps (%d updated), released %d maps",
+                    len(report["updated"]) + len(report["unchanged"]), len(report["updated"]), len(report["released"]))
+
+# Policies for combining wildcard-matched signals into maps
+match_policies = ["all", "same_ordinal", "nearest_name", "first_match"]
+
+def match_signals(map, srcs, dsts, policy="all"):
+    """lazily generates the (source list, destination) signal combinations to map for a session map
+
+    :param map (Dict): The session map
+    :param srcs (List): The matching signals for each of the map's sources
+    :param dsts (List): The matching signals for the map's destination
+    :optional param policy (String): 'all' combines every matching signal, 'same_ordinal' only combines
+        signals whose devices have the same ordinal (e.g. 'synth.2/out' -> 'fx.2/in'), 'nearest_name'
+        uses the signals whose device names are closest to those in the session, and 'first_match' uses
+        the first matching signals. Default 'all'
+    """
+    if not dsts or not all(srcs):
+        return
+    if policy == "first_match":
+        yield [sigs[0] for sigs in srcs], dsts[0]
+    elif policy == "nearest_name":
+        dev_names = [name.split('/', 1)[0] for name in map["sources"]]
+        yield ([nearest_sig(sigs, dev_name) for sigs, dev_name in zip(srcs, dev_names)],
+               nearest_sig(dsts, map["destinations"][0].split('/', 1)[0]))
+    elif policy == "same_ordinal":
         for dst in dsts:
-            for src_list in src_list_list:
-                # Create map
-                new_map = mpr.Map(list(src_list), dst)
-                if not new_map:
-                    print("error: failed to create map", map["sources"], "->", map["destinations"])
-                    continue
-                print("created map:", [s['name'] for s in new_map.signals(mpr.Map.Location.SOURCE)],
-                      "->", [s['name'] for s in new_map.signals(mpr.Map.Location.DESTINATION)])
-
-                # Check if map already exists
-#                print('map status is', new_map[mpr.Property.STATUS])
-#                if new_map[mpr.Property.STATUS] is not mpr.Status.STAGED:
-#                    print('map exists already, overwriting properties')
-
-                # when maps are created the source signals are alphabetised to create a standard representation
-                # if our source signals have swapped position we need to edit the expression
-                old_idx = 0
-                newExp = map["expression"]
-                if len(src_list) > 1:
-                    for i in list(src_list):
-                        new_idx = new_map.index(i, mpr.Location.SOURCE)
-                        if new_idx != old_idx:
-                            print('  remapping expression sources:', old_idx, '->', new_idx)
-                            newExp = re.sub(r'x\$({0})'.format(old_idx), r'x${0}'.format(new_idx), newExp)
-                        old_idx = old_idx + 1
-                print("  set 'expression' to '{0}'".format(newExp))
-                new_map[mpr.Property.EXPRESSION] = newExp
-
-                # Set map properties
-                for key in map:
-                    val = map[key]
-                    if key == "sources" or key == "destinations" or key == "expression":
-                        pass # already handled
-                    elif key == "muted":
-                        new_map[mpr.Property.MUTED] = val
-                    elif key == "process_loc":
-                        if val == 'SOURCE' or val == 'src':
-                            new_map[mpr.Property.PROCESS_LOCATION] = mpr.Map.Location.SOURCE
-                        elif val == 'DESTINATION' or val == 'dst':
-                            new_map[mpr.Property.PROCESS_LOCATION] = mpr.Map.Location.DESTINATION
-                    elif key == "protocol":
-                        if val == 'udp' or val == 'UDP':
-                            new_map[mpr.Property.PROTOCOL] = mpr.Map.Protocol.UDP
-                        elif val == 'tcp' or val == 'TCP':
-                            new_map[mpr.Property.PROTOCOL] = mpr.Map.Protocol.TCP
-                    elif key == "scope":
-                        # TODO: Remove existing scopes?
-
-                        # Map scope property may need to be translated!
-                        for scope in map["scope"]:
-                            src_dev_names = [sig_name.split('/', 1)[0] for sig_name in map["sources"]]
-                            if scope in src_dev_names:
-                                idx = [sig_name.split('/', 1)[0] for sig_name in map["sources"]].index(scope)
-                                # Look up corresponding device in actual map.
-                                # Use src_list here since order may be different in new_map.signals()
-                                new_map.add_scope(src_list[idx].device())
-                            elif scope == map["destinations"][0].split('/', 1)[0]:
-                                new_map.add_scope(dst.device())
-                            else:
-                                dev = graph.devices().filter(mpr.Property.NAME, scope)
-                                if dev:
-                                    new_map.add_scope(dev.next())
-                                else:
-                                    print("  failed to find scope device named '{0}'".format(scope))
-                    elif key == "session":
-                        # TODO: session property should be an array
-                        tags = new_map['session']
-                        if tags:
-                            if isinstance(tags, list):
-                                if val not in tags:
-                                    tags.append(val)
-                            elif tags != val:
-                                tags = [tags, val]
-                            val = tags
-                        new_map[key] = val
-                    else:
-                        new_map[key] = val
+            ordinal = dev_ordinal(dst)
+            for src_list in itertools.product(*[[sig for sig in sigs if dev_ordinal(sig) == ordinal]
+                                                for sigs in srcs]):
+                yield list(src_list), dst
+    else:
+        for dst in dsts:
+            for src_list in itertools.product(*srcs):
+                yield list(src_list), dst
+
+def dev_ordinal(sig):
+    name = sig.device()[mpr.Property.NAME]
+    return name.rsplit('.', 1)[-1] if '.' in name else None
+
+def nearest_sig(sigs, dev_name):
+    return max(sigs, key=lambda sig: difflib.SequenceMatcher(None, sig.device()[mpr.Property.NAME], dev_name).ratio())
+
+# Sets the expression and other properties of a session map on a libmapper map
+# If 'only_changed' is True properties that already have the desired value are left alone, which is
+# used when reconciling existing maps. 'resolved' can be a previous result of resolve_map_properties()
+# for the same signals. Returns the number of properties that were set.
+def set_map_properties(new_map, map, src_list, dst, index, only_changed=False, resolved=None):
+    changed = 0
+
+    def set_prop(key, val):
+        nonlocal changed
+        if only_changed and new_map[key] == val:
+            return
+        new_map[key] = val
+        changed += 1
+
+    # when maps are created the source signals are alphabetised to create a standard representation
+    # if our source signals have swapped position we need to edit the expression
+    newExp = map["expression"]
+    if len(src_list) > 1:
+        order = tuple(new_map.index(sig, mpr.Location.SOURCE) for sig in src_list)
+        if order != tuple(range(len(order))):
+            logger.debug('  remapping expression sources: %s -> %s', list(range(len(order))), list(order))
+            newExp = reorder_sources(newExp, order)
+    logger.debug("  set 'expression' to '%s'", newExp)
+    set_prop(mpr.Property.EXPRESSION, newExp)
+
+    # Set map properties
+    props, scopes = resolved if resolved is not None else resolve_map_properties(map, src_list, dst, index)
+    for key, val in props:
+        set_prop(key, val)
+
+    if scopes:
+        # TODO: Remove existing scopes?
+        current = new_map['scope'] if only_changed else None
+        scope_names = [dev[mpr.Property.NAME] for dev in current] if current else []
+        for dev in scopes:
+            if dev[mpr.Property.NAME] not in scope_names:
+                new_map.add_scope(dev)
+                changed += 1
+
+    if "session" in map:
+        # TODO: session property should be an array
+        val = map["session"]
+        tags = new_map['session']
+        if tags:
+            if isinstance(tags, list):
+                if val not in tags:
+                    tags.append(val)
+            elif tags != val:
+                tags = [tags, val]
+            val = tags
+        set_prop("session", val)
+    return changed
+
+# Properties that saved sessions record but libmapper maintains, so they are never set on maps
+runtime_map_properties = ["id", "version", "status", "expr", "bundle", "is_local", "num_sigs_in"]
+
+# Translates the properties of a session map into libmapper properties for a map between the given
+# signals. Returns a list of (key, value) pairs and a list of scope devices. The expression and session
+# tag depend on the libmapper map and are handled by set_map_properties().
+def resolve_map_properties(map, src_list, dst, index):
+    props = []
+    scopes = []
+    for key in map:
+        val = map[key]
+        if key == "sources" or key == "destinations" or key == "expression" or key == "session":
+            pass # handled by set_map_properties()
+        elif key in runtime_map_properties:
+            pass
+        elif key == "muted":
+            props.append((mpr.Property.MUTED, val))
+        elif key == "process_loc":
+            if val == 'SOURCE' or val == 'src':
+                props.append((mpr.Property.PROCESS_LOCATION, mpr.Map.Location.SOURCE))
+            elif val == 'DESTINATION' or val == 'dst':
+                props.append((mpr.Property.PROCESS_LOCATION, mpr.Map.Location.DESTINATION))
+        elif key == "protocol":
+            if val == 'udp' or val == 'UDP':
+                props.append((mpr.Property.PROTOCOL, mpr.Map.Protocol.UDP))
+            elif val == 'tcp' or val == 'TCP':
+                props.append((mpr.Property.PROTOCOL, mpr.Map.Protocol.TCP))
+        elif key == "scope":
+            # Map scope property may need to be translated!
+            src_dev_names = [sig_name.split('/', 1)[0] for sig_name in map["sources"]]
+            for scope in map["scope"]:
+                if scope in src_dev_names:
+                    idx = src_dev_names.index(scope)
+                    # Look up corresponding device in actual map.
+                    # Use src_list here since order may be different in new_map.signals()
+                    dev = src_list[idx].device()
+                elif scope == map["destinations"][0].split('/', 1)[0]:
+                    dev = dst.device()
+                else:
+                    dev = index.device(scope)
+                    if not dev:
+                        logger.warning("  failed to find scope device named '%s'", scope)
+                        continue
+                scopes.append(dev)
+        else:
+            props.append((key, val))
+    return props, scopes
 
-                # Push to network
-                new_map.push()
-                new_maps.append(map.copy())
-    graph.poll()
-    return new_maps
+# Key used to match session maps with existing maps: sorted source names and the destination name
+def map_key(srcs, dst):
+    return (tuple(sorted(full_name(sig) for sig in srcs)), full_name(dst))
+
+def full_name(sig):
+    return sig.device()[mpr.Property.NAME] + "/" + sig[mpr.Property.NAME]
 
-def start_session(graph, filenames):
+def start_session(graph, filenames, device_map=None, match="all", max_fanout=256):
     """start an interactive session. A libmapper signal is created for loading/unloading each file.
-    
+
+    Each file is prepared once and its maps resolved against the graph in advance, so toggling a
+    signal only pushes the maps that change. Plans are resolved again when devices or signals
+    change, or when a file is modified.
+
     :param filenames (String or List): The JSON files to load
+    :optional param device_map, match, max_fanout: As for load()
     :return (None): Blocks while executing, should CTL+C or hit 'e' to exit
     """
+    get_manager(graph).start_session(filenames, device_map, match, max_fanout)
 
-    graph = check_graph(graph, sync=False)
+def plan_session(graph, filename, device_map=None, match="all", max_fanout=256):
+    """returns the resolved plan for loading a session file, see switch_session()
 
-    global session_filenames, stop_session
-    session_filenames = filenames
+    The file is only prepared again if it has been modified, and its maps are only resolved again
+    if devices or signals on the graph have changed since the plan was made.
 
-    # Set up libmapper signal that controls the current session index
-    dev = mpr.Device("mappersession", graph)
-    for filename in session_filenames:
-        signame = filename.removesuffix(".json").split('/')[-1]
-        # TODO: need to handle duplicate filenames?
-        sig = dev.add_signal(mpr.Signal.Direction.INCOMING, signame, 1, mpr.Type.INT32,
-                             None, 0, 1, None)
-        sig.add_callback(cur_session_handler)
-        sig.set_property("filename", filename, publish=False)
+    :return (Dict): The plan, or None if the file could not be loaded
+    """
+    return get_manager(graph).plan_session(filename, device_map, match, max_fanout)
 
-    while (not stop_session):
-        dev.poll(50)
+def switch_session(graph, filename, active, device_map=None, match="all", max_fanout=256):
+    """loads or unloads a session file using its precomputed plan
 
-    dev.free()
-    if graph is not None:
-        graph.free()
+    Maps that already belong to the session are left alone and existing maps from other sessions
+    only have their changed properties pushed, so switching between overlapping sessions is cheap.
+    Maps are pushed without waiting for them to become active.
 
-def cur_session_handler(obj, event, id):
-    global session_filenames
-    try:
-        if event == mpr.Object.Event.REMOTE_UPDATE:
-            filename = obj['filename']
-            if val == 0:
-                print('unloading', filename)
-                unload(filename, graph = obj.graph())
-            else:
-                print('loading', filename)
-                load(filename, graph = obj.graph())
-    except:
-        print('exception')
-        print(obj, event)
+    :param filename (String): The JSON file to load or unload
+    :param active (Boolean): True to load the session, False to unload it
+    :return (Dict): The report of a load as for try_make_maps(), or None
+    """
+    return get_manager(graph).switch_session(filename, active, device_map, match, max_fanout)
 
-def load(filename, interactive=False, wait=False, persist=False, background=False, device_map=None, graph=None):
+def load(filename, interactive=False, wait=False, persist=False, background=False, device_map=None, graph=None, validate=True,
+         reconcile=False, release=False, workers=None, match="all", max_fanout=256, until=None):
     """loads a session file with options for staging
 
     :param filenames (String or List): The JSON file(s) to load
@@ -314,28 +1665,21 @@ def load(filename, interactive=False, wait=False, persist=False, background=Fals
     :optional param persist (Boolean): Continue running after creating maps in session, and recreate them as matching signals (re)appear, default False
     :optional param background (Boolean): Wait for missing signals in a background thread, default True
     :optional param graph (libmapper Graph object): A previously-allocated libmapper graph object to use. If not provided one will be allocated internally.
-    :return (Dict): visual session information relevant to GUIs
+    :optional param validate (Boolean): Validate sessions against the schema, default True. Files that passed validation and haven't changed since are not validated again.
+    :optional param reconcile (Boolean): Only create missing maps and push changed properties of existing maps, default False
+    :optional param release (Boolean): When reconciling, also release existing maps that are not part of the loaded sessions, default False
+    :optional param workers (Integer): Number of worker processes used to parse, upgrade and validate multiple files, at most one per file. Default None prepares files in this process. Worker processes take about a second to start, so this only helps for large files, and the calling script must guard its entry point with "if __name__ == '__main__'".
+    :optional param device_map (Dict): Rules translating device names in the session to devices on the network, see DeviceMatcher. Default None matches signals on any device.
+    :optional param match (String): How signals matched on several devices are combined into maps: 'all', 'same_ordinal', 'nearest_name' or 'first_match'. Default 'all'
+    :optional param max_fanout (Integer): Maximum number of maps created for each map in the session, default 256. None for no limit.
+    :optional param until (Float): For session journals ('.journal' files written by record()), restore the maps as they were at this time in seconds since the epoch. Default None restores the latest recorded state.
+    :return (Dict): visual session information relevant to GUIs, see last_stats() for timings
     """
+    return get_manager(graph).load(filename, interactive, wait, persist, background, device_map, validate, reconcile,
+                                   release, workers, match, max_fanout, until)
 
-    if interactive:
-        return start_session(graph, filename)
-
-    if not isinstance(filename, list):
-        filename = [filename]
-    views = []
-    values = []
-
-    for name in filename:
-        # Parse session file
-        file = open(name)
-        data = json.load(file)
-        # Load session
-        session_views, session_values = load_json(data, name, wait, persist, background, device_map, graph)
-        views.extend(session_views)
-        values.extend(session_values)
-    return views, values
-
-def load_json(session_json, name=None, wait=False, persist=False, background=False, device_map=None, graph=None):
+def load_json(session_json, name=None, wait=False, persist=False, background=False, device_map=None, graph=None,
+              validate=True, reconcile=False, release=False, match="all", max_fanout=256):
     """loads a session JSON Dict with options for staging
 
     :param session_json (Dict): A session JSON Dict to load
@@ -344,125 +1688,136 @@ def load_json(session_json, name=None, wait=False, persist=False, background=Fal
     :optional param persist (Boolean): Continue running after creating maps in session, and recreate them as matching signals (re)appear, default False
     :optional param background (Boolean): True if any staging should happen in a background thread, default True
     :optional param graph (libmapper Graph object): A previously-allocated libmapper graph object to use. If not provided one will be allocated internally.
-    :return (Dict): visual session information relevant to GUIs
+    :optional param validate (Boolean): Validate the session against the schema, default True. Set to False for trusted or already-validated sessions.
+    :optional param reconcile (Boolean): Only create missing maps and push changed properties of existing maps, default False
+    :optional param release (Boolean): When reconciling, also release existing maps that are not part of the session, default False
+    :optional param device_map (Dict): Rules translating device names in the session to devices on the network, see DeviceMatcher. Default None matches signals on any device.
+    :optional param match (String): How signals matched on several devices are combined into maps: 'all', 'same_ordinal', 'nearest_name' or 'first_match'. Default 'all'
+    :optional param max_fanout (Integer): Maximum number of maps created for each map in the session, default 256. None for no limit.
+    :return (Dict): visual session information relevant to GUIs, see last_stats() for timings
     """
+    return get_manager(graph).load_json(session_json, name, wait, persist, background, device_map, validate, reconcile,
+                                        release, match, max_fanout)
 
-    global staging_thread, staged_maps, current_fileversion
+def prepare_file(filename, validate=True, stats=None, cache=None, use_cache=True):
+    """parses a session file and prepares it for loading, see prepare_json()
 
-    graph = check_graph(graph)
+    This is run in worker processes by load() so it must not use the graph.
+
+    :optional param cache (SessionCache): Cache of prepared sessions to use, default is the one set with set_cache()
+    :optional param use_cache (Boolean): Look the file up in the cache before preparing it, default True. The prepared session is stored in the cache either way.
+    """
+    if stats is None:
+        stats = SessionStats("prepare")
+    if cache is None:
+        cache = session_cache
+    if cache is not None:
+        if use_cache:
+            with stats.phase("cache"):
+                session_json = cache.get(filename, validate)
+            if session_json is not None:
+                stats.count("cache_hits")
+                return session_json
+        stat = os.stat(filename)
+    with stats.phase("parse"), open_session_file(filename) as file:
+        data = json.load(file)
+    session_json = prepare_json(data, filename, validate, stats)
+    if cache is not None and session_json is not None:
+        with stats.phase("cache"):
+            cache.put(filename, session_json, validate, stat)
+    return session_json
+
+# Runs prepare_file() in a worker process, returning the prepared session and the timings
+def prepare_file_with_stats(filename, validate=True, cache=None):
+    stats = SessionStats("prepare")
+    return prepare_file(filename, validate, stats, cache, use_cache=False), stats
+
+def prepare_json(session_json, name=None, validate=True, stats=None):
+    """upgrades, tags and validates a session JSON Dict
+
+    :param session_json (Dict): A session JSON Dict
+    :optional param name (String): Tag for maps in this session
+    :optional param validate (Boolean): Validate the session against the schema, default True
+    :optional param stats (SessionStats): Adds the upgrade and validate timings and any failures to these stats
+    :return (Dict): The prepared session, or None if it could not be upgraded or validated
+    """
+
+    if stats is None:
+        stats = SessionStats("prepare")
 
     # Update json if fileversion doesn't match current schema
-    session_json = upgrade_json(session_json)
+    with stats.phase("upgrade"):
+        session_json = upgrade_json(session_json)
+    if session_json is None:
+        # upgrade_json() has already logged the reason
+        stats.failures.append("could not upgrade session file")
+        return None
+
+    # Validate session according to schema, before its tables are decoded
+    if validate:
+        try:
+            with stats.phase("validate"):
+                get_validator().validate(session_json)
+        except jsonschema.exceptions.ValidationError as err:
+            stats.fail("session failed validation: {0}".format(err))
+            return None
+    with stats.phase("upgrade"):
+        session_json = decode_tables(session_json)
+    if session_json is None:
+        stats.failures.append("could not decode session tables")
+        return None
 
     if 'maps' in session_json and name is not None:
-        name = name.removesuffix(".json").split('/')[-1]
+        name = session_name(name)
         for map in session_json['maps']:
             map['session'] = name
-
-    # Validate session according to schema
-    schemaData = pkgutil.get_data(__name__, "mappingSessionSchema.json")
-    schema = json.loads(schemaData.decode("utf-8"))
-    try:
-        validate(instance=session_json, schema=schema)
-    except jsonschema.exceptions.ValidationError as err:
-        print(err)
-        return None, None
-
-    if wait or persist:
-        if wait == True:
-            timeout = False
-        elif wait == False or wait <= 0:
-            timeout = True
-        else:
-            timeout = time.monotonic() + wait
-        # add persist and timeout properties to each map
-        for map in session_json["maps"]:
-            if persist:
-                map['persist'] = True
-            elif wait:
-                map['timeout'] = timeout
-            print(map)
-        staged_maps.extend(session_json["maps"])
-        print(staged_maps)
-        if staging_thread == None:
-            if background:
-                staging_thread = threading.Thread(target = wait_for_sigs, daemon = True)
-                staging_thread.start()
-            else:
-                wait_for_sigs()
-    else:
-        maps = session_json["maps"]
-        new_maps = try_make_maps(graph, maps, device_map)
-        print("loaded {0}/{1} maps".format(len(new_maps), len(maps)))
-
-    return session_json["views"], session_json["values"]
+    return session_json
 
 def unload(filename, graph=None):
     """unloads session files
 
+    Maps that are only owned by the unloaded sessions are released. Maps that are also owned by
+    other loaded sessions are kept, and restored to the properties of the most recently loaded
+    session that still owns them. Maps that are still tagged with other sessions, e.g. ones loaded
+    by another process, only have the unloaded sessions' tags removed.
+
     :param filename (String or List): The JSON file(s) to unload
     :optional param graph (libmapper Graph object)
+    :return (SessionStats): Timings and counts of the unload
     """
+    return get_manager(graph).unload(filename)
 
-    # for now we will just clear maps with matching session tags
-    # TODO: restore maps that belong to other loaded sessions
-
-    graph = check_graph(graph)
+def clear(tag=None, graph=None):
+    """clears maps on the network except for those connected to mappersession
 
-    if not isinstance(filename, list):
-        filename = [filename]
+    :optional param tag (String): Only clear maps with this session tag
+    :optional param graph (libmapper Graph object)
+    :return (SessionStats): Timings and counts of the clear
+    """
+    return get_manager(graph).clear(tag)
 
-    for name in filename:
-        name = name.removesuffix(".json").split('/')[-1]
-        clear(name, graph)
+def tags(graph=None):
+    """returns the session tags of the maps on the network
 
-def clear(tag=None, graph=None):
-    """clears maps on the network except for those connected to mappersession
+    :optional param graph (libmapper Graph object)
+    :return (List): The active session tags
     """
+    return get_manager(graph).tags()
 
-    graph = check_graph(graph)
+def tag_counts(graph=None):
+    """returns the number of maps on the network with each session tag
 
-    maps = graph.maps()
-    unloaded = 0
-    if tag:
-        print("releasing maps with session tag '{0}'".format(tag))
-        maps = maps.filter('session', tag, mpr.Operator.EQUAL | mpr.Operator.ANY)
-    for map in maps:
-        dstSigs = map.signals(mpr.Map.Location.DESTINATION)
-        # Only remove if mappersession isn't the destination
-        if "mappersession" in dstSigs[0].device()[mpr.Property.NAME]:
-            continue
-        if tag:
-            tags = map['session']
-            if isinstance(tags, list):
-                # remove session tag from list and continue without removing
-                tags.remove(tag)
-                map['session'] = tags
-                map.push()
-                continue
-        print("  releasing map:", [s['name'] for s in map.signals(mpr.Map.Location.SOURCE)],
-              "->", [s['name'] for s in map.signals(mpr.Map.Location.DESTINATION)])
-        map.release()
-        unloaded += 1
-    graph.poll()
-    print("released {0} maps".format(unloaded))
+    :optional param graph (libmapper Graph object)
+    :return (Dict): Map counts keyed by session tag
+    """
+    return get_manager(graph).tag_counts()
 
-def tags(graph=None):
-    graph = check_graph(graph)
-    active_sessions = []
-    maps = graph.maps()
+def last_stats():
+    """returns the timings and counts of the most recent load, unload, save or clear
 
-    for map in maps:
-        if any([sig.device()["hidden"] for sig in map.signals()]):
-            continue
-        tags = map['session']
-        if isinstance(tags, list):
-            for tag in tags:
-                if tag not in active_sessions:
-                    active_sessions.append(tag)
-        elif tags is not None and tags not in active_sessions:
-            active_sessions.append(tags)
-    return active_sessions
+    :return (SessionStats): The statistics, or None if no operation has finished yet
+    """
+    return latest_stats
 
 def get_views(file, view_name):
     """retrieves view-related GUI parameters from a session json file
@@ -471,24 +1826,87 @@ def get_views(file, view_name):
     :param view_name (String): Name of the target view
     :return (Dict): visual session information relevant to GUIs, None if not found
     """
-    schema = json.load(open("mappingSessionSchema.json"))
-    data = json.load(open(file))
-    validate(instance=data, schema=schema)
+    with open_session_file(file) as f:
+        data = json.load(f)
+    get_validator().validate(data)
     for view in data["views"]:
         if view["name"] == view_name:
             return view["data"]
     return None
 
-def upgrade_json(session_json):
+def get_validator():
+    """returns the session schema validator, compiling it the first time it is needed"""
+    global schema_validator
+    if schema_validator is None:
+        schemaData = pkgutil.get_data(__name__, "mappingSessionSchema.json")
+        schema = json.loads(schemaData.decode("utf-8"))
+        validator_class = jsonschema.validators.validator_for(schema)
+        schema_validator = validator_class(schema)
+    return schema_validator
+
+# Source signal references in expressions, e.g. 'x$1'
+source_ref = re.compile(r'(?<![\w$])x\$(\d+)')
+
+@functools.lru_cache(maxsize=4096)
+def reorder_sources(expression, order):
+    """rewrites the source references in an expression for a new source order, in a single pass
+
+    :param expression (String): The map expression
+    :param order (Tuple): The new index of each source, indexed by its old index
+    :return (String): The rewritten expression
+    """
+    def replace(match):
+        idx = int(match.group(1))
+        return 'x$' + str(order[idx]) if idx < len(order) else match.group(0)
+    return source_ref.sub(replace, expression)
+
+# Legacy signal identifiers in expressions, matched in the order that they are upgraded
+legacy_ref = re.compile(r'(?:dest|dst)\[([\d+])\]|dest|dst|src\[([\d+])\]|src')
+legacy_ref_2_0 = re.compile(r'(?:dest|dst)\[([\d+])\]|dest|dst|src\[([\d+])\]|src|d\[([\d+])\]|s\[([\d+])\]')
+
+@functools.lru_cache(maxsize=4096)
+def upgrade_expression(expression, v2_0=False):
+    """rewrites the legacy signal identifiers in an expression in a single pass
+
+    :param expression (String): The legacy map expression
+    :optional param v2_0 (Boolean): Also upgrade the short 'd[N]' and 's[N]' identifiers used by version 2.0
+    :return (String): The upgraded expression
+    """
+    # TODO: make sure we are not garbling functions!
+    # ok if string as nothing before/after except operator or bracket
+    def replace(match):
+        dst_idx, src_idx, d_idx, s_idx = (match.groups() + (None, None))[:4]
+        if dst_idx is not None:
+            return 'y$' + dst_idx
+        elif src_idx is not None:
+            return 'x$' + src_idx
+        elif d_idx is not None:
+            return 'y$' + d_idx
+        elif s_idx is not None:
+            return 'x$' + s_idx
+        return 'x' if match.group(0) == 'src' else 'y'
+    return (legacy_ref_2_0 if v2_0 else legacy_ref).sub(replace, expression)
+
+# Upgrades a legacy session JSON Dict to the current fileversion, returning None if it is unsupported
+# Loading a legacy file is logged unless 'notify' is False
+# Upgrades a session to the current fileversion. The device and signal tables of current sessions are
+# left for decode_tables(), so that they can be validated first.
+def upgrade_json(session_json, notify=True):
     global current_fileversion
     if session_json["fileversion"] == current_fileversion:
         return session_json
+    if session_json["fileversion"] == "2.4":
+        # 2.5 only added the optional device, signal and default property tables
+        session_json["fileversion"] = current_fileversion
+        return session_json
     version = float(session_json["fileversion"])
     if version < 2.0 or version > float(current_fileversion):
-        print("Failed to load session with unsupported version: ", version)
+        if notify:
+            logger.error("Failed to load session with unsupported version: %s", version)
         return
-    print("Loading legacy file with version: ", version)
-    print("Consider re-saving the session to update to the most recent version.")
+    if notify:
+        logger.info("Loading legacy file with version: %s", version)
+        logger.info("Consider re-saving or migrating the session to update to the most recent version.")
     session_json["maps"] = []
     session_json["description"] = ""
     session_json["views"] = [] # Unable to use legacy views, some fields are not present
@@ -521,21 +1939,8 @@ def upgrade_json(session_json):
                 pass
             elif key == "expression" or key == "expr":
                 # Fix expressions that use legacy signal identifiers
-                print('upgrading expression...')
-                print('  ', val)
-                newExp = re.sub(r'(dest|dst)\[([\d+])\]', r'y$\2', val)\
-                           .replace('dest', 'y')\
-                           .replace('dst', 'y')
-                print('  ', newExp)
-                newExp = re.sub(r'src\[([\d+])\]', r'x$\1', newExp)\
-                           .replace('src', 'x')
-                print('  ', newExp)
-                if version <= 2.0:
-                    # TODO: make sure we are not garbling functions!
-                    # ok if string as nothing before/after except operator or bracket
-                    newExp = re.sub(r'd\[([\d+])\]', r'y$\1', newExp)
-                    newExp = re.sub(r's\[([\d+])\]', r'x$\1', newExp)
-                print('  ', newExp)
+                newExp = upgrade_expression(val, version <= 2.0)
+                logger.debug("upgraded expression '%s' to '%s'", val, newExp)
                 newMap["expression"] = newExp
             elif key == "mute": # <= 2.2
                 newMap["muted"] = (val == 1)
@@ -565,30 +1970,871 @@ def upgrade_json(session_json):
     session_json["fileversion"] = current_fileversion # Not really necessary I suppose
     return session_json
 
-def find_sigs(graph, fullname, device_map=None):
+# Keys of the tables in sessions saved with save(tables=True)
+table_keys = ["devices", "signals", "defaults"]
+
+def encode_tables(session_json):
+    """returns a copy of a session that uses device and signal tables and default map properties
+
+    Devices are listed once in 'devices' and signals once in 'signals' as [device index, signal name]
+    pairs. Maps refer to signals and scope devices by their index in these tables. Properties that
+    every map has are given their most common value in 'defaults', and maps only include them when
+    they differ. decode_tables() reverses this.
+    """
+    devices = []
+    device_index = {}
+    signals = []
+    signal_index = {}
+
+    def device(name):
+        i = device_index.get(name)
+        if i is None:
+            i = device_index[name] = len(devices)
+            devices.append(name)
+        return i
+
+    def signal(fullname):
+        i = signal_index.get(fullname)
+        if i is None:
+            dev_name, sig_name = fullname.split('/', 1)
+            i = signal_index[fullname] = len(signals)
+            signals.append([device(dev_name), sig_name])
+        return i
+
+    maps = session_json["maps"]
+    defaults = {}
+    if len(maps) > 1:
+        keys = set(maps[0]).intersection(*maps[1:]) - {"sources", "destinations"}
+        for key in sorted(keys):
+            counts = collections.Counter(json.dumps(map[key], sort_keys=True) for map in maps)
+            value, count = counts.most_common(1)[0]
+            if count > 1:
+                defaults[key] = json.loads(value)
+    default_values = {key: json.dumps(val, sort_keys=True) for key, val in defaults.items()}
+    if "scope" in defaults:
+        defaults["scope"] = [device(name) for name in defaults["scope"]]
+
+    compact_maps = []
+    for map in maps:
+        compact_map = {"sources": [signal(name) for name in map["sources"]],
+                       "destinations": [signal(name) for name in map["destinations"]]}
+        for key, val in map.items():
+            if key in compact_map or default_values.get(key) == json.dumps(val, sort_keys=True):
+                continue
+            compact_map[key] = [device(name) for name in val] if key == "scope" else val
+        compact_maps.append(compact_map)
+
+    compact = {key: val for key, val in session_json.items() if key != "maps" and key not in table_keys}
+    compact.update(devices=devices, signals=signals, defaults=defaults, maps=compact_maps)
+    return compact
+
+def decode_tables(session_json):
+    """expands the device and signal tables and default map properties of a session, see encode_tables()
+
+    :return (Dict): The session with full signal and device names in every map, or None if the tables are invalid
+    """
+    if not any(key in session_json for key in table_keys):
+        return session_json
+    try:
+        devices = session_json.pop("devices", [])
+        signals = [devices[dev] + "/" + name for dev, name in session_json.pop("signals", [])]
+        defaults = session_json.pop("defaults", {})
+        maps = []
+        for map in session_json["maps"]:
+            expanded = {}
+            for key, val in itertools.chain(defaults.items(), map.items()):
+                if key == "sources" or key == "destinations":
+                    val = [signals[i] if isinstance(i, int) else i for i in val]
+                elif key == "scope":
+                    val = [devices[i] if isinstance(i, int) else i for i in val]
+                elif isinstance(val, (list, dict)):
+                    val = copy.deepcopy(val)
+                expanded[key] = val
+            maps.append(expanded)
+    except (IndexError, TypeError, ValueError) as err:
+        logger.error("Failed to load session with invalid device or signal tables: %s", err)
+        return None
+    session_json["maps"] = maps
+    return session_json
+
+# Matches the fileversion near the start of a session file
+fileversion_ref = re.compile(r'"fileversion"\s*:\s*"([^"]*)"')
+
+def migrate(paths, workers=None, validate=True):
+    """upgrades legacy session files to the current fileversion in place
+
+    Directories are searched recursively for session files ending in '.json', optionally followed by
+    a compression extension. Files are migrated in worker processes and each one is replaced
+    atomically, so an interrupted migration never leaves a partly written file. Files that are
+    already current are skipped without parsing them, and files that fail to upgrade or validate
+    are left unchanged.
+
+    :param paths (String or List): Session files and directories to migrate
+    :optional param workers (Integer): Number of worker processes, default is one per CPU. Set to 1 to migrate in this process.
+    :optional param validate (Boolean): Validate upgraded sessions against the schema before writing them, default True
+    :return (List): A Dict for each file with its 'file', 'status' ('current', 'migrated' or 'failed'), original 'fileversion', 'seconds' taken and any 'error'
+    """
+    if not isinstance(paths, list):
+        paths = [paths]
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                filenames.extend(os.path.join(root, name) for name in sorted(files) if is_session_filename(name))
+        else:
+            filenames.append(path)
+
+    start = time.perf_counter()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(filenames) > 1:
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as executor:
+            results = list(executor.map(migrate_file, filenames, itertools.repeat(validate), chunksize=16))
+    else:
+        results = [migrate_file(filename, validate) for filename in filenames]
+
+    counts = {"current": 0, "migrated": 0, "failed": 0}
+    for result in results:
+        counts[result["status"]] += 1
+        if result["status"] == "failed":
+            logger.error("failed to migrate %s: %s", result["file"], result["error"])
+        else:
+            logger.debug("%s %s (version %s) in %.1f ms", result["status"], result["file"], result["fileversion"],
+                         result["seconds"] * 1000)
+    logger.info("migrated %d files, %d already current, %d failed in %.2f seconds", counts["migrated"],
+                counts["current"], counts["failed"], time.perf_counter() - start)
+    return results
+
+def is_session_filename(filename):
+    for ext in compressed_extensions:
+        if filename.endswith(ext):
+            filename = filename[:-len(ext)]
+            break
+    return filename.endswith(".json")
+
+# Migrates one session file for migrate(), run in worker processes so it must not use the graph
+def migrate_file(filename, validate=True):
+    start = time.perf_counter()
+    result = {"file": filename, "status": "failed", "fileversion": None, "seconds": 0.0, "error": None}
+    try:
+        # Files saved by mappersession start with their fileversion, so current files can be
+        # skipped without parsing them
+        with open_session_file(filename) as file:
+            found = fileversion_ref.search(file.read(1024))
+        if found and found.group(1) in (plain_fileversion, current_fileversion):
+            result.update(status="current", fileversion=found.group(1))
+            return result
+
+        with open_session_file(filename) as file:
+            session_json = json.load(file)
+        result["fileversion"] = session_json.get("fileversion")
+        if result["fileversion"] in (plain_fileversion, current_fileversion):
+            result["status"] = "current"
+            return result
+        session_json = upgrade_json(session_json, notify=False)
+        if session_json is None:
+            result["error"] = "unsupported fileversion {0}".format(result["fileversion"])
+            return result
+        if validate:
+            get_validator().validate(session_json)
+
+        with replace_session_file(filename) as file:
+            write_session(file, session_json, session_json["maps"])
+        result["status"] = "migrated"
+    except jsonschema.exceptions.ValidationError as err:
+        result["error"] = "failed validation: {0}".format(err.message)
+    except (OSError, ValueError, KeyError, TypeError) as err:
+        result["error"] = "{0}: {1}".format(type(err).__name__, err)
+    finally:
+        result["seconds"] = time.perf_counter() - start
+    return result
+
+class SessionStats:
+    """Timings, counts and failures of a load, unload, save or clear.
+
+    Timings are in seconds for each phase: 'sync' (graph sync), 'parse', 'upgrade', 'validate',
+    'match' (finding signals and building maps), 'push', 'verify' (waiting for maps to become
+    active), 'cache' (reading and writing the persistent cache), 'replay' (reading session journals),
+    'previous' (reading the existing file for an incremental save), 'filter', 'collect' and 'write'
+    when saving, and 'total'. Files prepared in worker processes add their parse, upgrade and
+    validate times together, so those can exceed the total. If a new graph
+    was allocated, 'sync' also holds the result of sync_graph().
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.timings = {}
+        self.counts = {}
+        self.failures = []
+        # result of sync_graph() if a new graph was synced
+        self.sync = None
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """times the enclosed block, adding it to the named phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def count(self, name, num=1):
+        self.counts[name] = self.counts.get(name, 0) + num
+
+    def fail(self, message):
+        """records and logs a failure"""
+        self.failures.append(message)
+        logger.error(message)
+
+    def add_report(self, report):
+        """adds the counts of a try_make_maps() report"""
+        for key, maps in report.items():
+            if maps:
+                self.count(key, len(maps))
+
+    def merge(self, other):
+        for name, seconds in other.timings.items():
+            self.add_time(name, seconds)
+        for name, num in other.counts.items():
+            self.count(name, num)
+        self.failures.extend(other.failures)
+
+    def finish(self):
+        """records the total time and makes these the stats returned by last_stats()"""
+        global latest_stats
+        self.timings["total"] = time.perf_counter() - self.start
+        latest_stats = self
+        logger.debug("%s stats: %s", self.operation, self.as_dict())
+
+    def as_dict(self):
+        return {"operation": self.operation, "timings": dict(self.timings), "counts": dict(self.counts),
+                "failures": list(self.failures), "sync": self.sync}
+
+    def __repr__(self):
+        return "SessionStats({0})".format(self.as_dict())
+
+class SessionCache:
+    """A directory of prepared sessions, so that unchanged files can be loaded without parsing,
+    upgrading or validating them again.
+
+    Entries are keyed by the session file's path. An entry is used if the file's modification time
+    and size are unchanged, or if only its modification time changed and its content hash still
+    matches. When the directory grows beyond 'max_size' bytes the least recently used entries are
+    removed. Entries are pickled, so the directory should only be writable by its owner.
+    """
+
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def entry_path(self, filename):
+        key = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + ".pickle")
+
+    def get(self, filename, validate=True):
+        """returns the prepared session for a file, or None if it isn't cached or has changed"""
+        path = self.entry_path(filename)
+        try:
+            stat = os.stat(filename)
+            with open(path, 'rb') as file:
+                entry = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError) as err:
+            logger.warning("ignoring unreadable cache entry %s: %s", path, err)
+            return None
+        if (entry.get("path") != os.path.abspath(filename) or entry.get("fileversion") != current_fileversion
+                or (validate and not entry["validated"])):
+            return None
+        if (entry["mtime_ns"], entry["size"]) != (stat.st_mtime_ns, stat.st_size):
+            if entry["size"] != stat.st_size or file_hash(filename) != entry["hash"]:
+                return None
+            # the file was touched but not changed
+            entry["mtime_ns"] = stat.st_mtime_ns
+            self.write(path, entry)
+        else:
+            # mark as recently used
+            os.utime(path)
+        return entry["session"]
+
+    def put(self, filename, session_json, validated, stat):
+        """stores a prepared session, 'stat' is the file's os.stat() result from before it was read"""
+        content_hash = file_hash(filename)
+        current = os.stat(filename)
+        if (current.st_mtime_ns, current.st_size) != (stat.st_mtime_ns, stat.st_size):
+            # changed while it was being prepared
+            return
+        entry = {"path": os.path.abspath(filename), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                 "hash": content_hash, "validated": validated, "fileversion": current_fileversion,
+                 "session": session_json}
+        self.write(self.entry_path(filename), entry)
+        self.evict()
+
+    def write(self, path, entry):
+        fd, temp_name = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(entry, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_name, path)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+
+    def evict(self):
+        """removes the least recently used entries until the cache fits in 'max_size' bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if item.name.endswith(".pickle"):
+                    stat = item.stat()
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+                    total += stat.st_size
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def set_cache(directory=None, max_size=64 * 1024 * 1024):
+    """sets a directory for caching prepared session files, see SessionCache
+
+    :optional param directory (String): The cache directory, or None to disable caching (the default)
+    :optional param max_size (Integer): Maximum size of the cache in bytes, default 64 MiB
+    """
+    global session_cache
+    session_cache = SessionCache(directory, max_size) if directory else None
+
+def is_journal_filename(filename):
+    return filename.endswith(journal_extension)
+
+class SessionJournal:
+    """Append-only journal of the changes to the maps on a graph.
+
+    Each line of the journal is a JSON record with the time it was written: a header with the file
+    version, then an 'add' record with the full session map record of each new map, a 'modify' record
+    with only the properties that changed, and a 'remove' record for each released map. The journal
+    is flushed after every record, so a crash loses at most the record being written. The recorded
+    state is kept in memory so that it can be compacted into a session file without reading the
+    journal again, and replay_journal() restores it from the journal up to any recorded time.
+
+    Example:
+        journal = SessionJournal("studio.journal", graph).start()
+        ...
+        journal.compact("studio.json")
+        journal.close()
+    """
+
+    def __init__(self, filename, graph, fsync=False):
+        """
+        :param filename (String): The journal file, which is appended to if it exists
+        :param graph (libmapper Graph object): The graph to record
+        :optional param fsync (Boolean): Sync every record to disk as well as flushing it, default False
+        """
+        self.filename = filename
+        self.graph = graph
+        self.fsync = fsync
+        self.file = None
+        # map_record_key() -> session map record, as recorded so far
+        self.maps = {}
+
+    def start(self):
+        """records the differences between the journal and the graph, then records changes as they happen"""
+        if os.path.exists(self.filename):
+            self.maps = replay_maps(self.filename)
+        self.file = open(self.filename, 'a', encoding="utf-8")
+        if self.file.tell() == 0:
+            self.append({"journal": current_fileversion})
+        current = {}
+        for map in self.graph.maps():
+            if is_saved_map(map):
+                record = add_map_properties(map_signal_names(map), map)
+                current[map_record_key(record)] = record
+        for key in [key for key in self.maps if key not in current]:
+            self.remove(key)
+        for record in current.values():
+            self.update(record)
+        add_graph_handler(self.graph, self.on_map_event, mpr.Type.MAP)
+        return self
+
+    def close(self):
+        """stops recording and closes the journal"""
+        remove_graph_handler(self.on_map_event)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def on_map_event(self, type, obj, event):
+        key = map_record_key(map_signal_names(obj))
+        if event == mpr.Graph.Event.REMOVED or event == mpr.Graph.Event.EXPIRED or not is_saved_map(obj):
+            if key in self.maps:
+                self.remove(key)
+        else:
+            self.update(add_map_properties(map_signal_names(obj), obj))
+
+    def update(self, record):
+        key = map_record_key(record)
+        old = self.maps.get(key)
+        if old is None:
+            entry = {"add": record}
+        else:
+            changed = {k: v for k, v in record.items() if old.get(k) != v}
+            removed = [k for k in old if k not in record]
+            if not changed and not removed:
+                return
+            entry = {"modify": [record["sources"], record["destinations"]], "set": changed}
+            if removed:
+                entry["unset"] = removed
+        self.maps[key] = record
+        self.append(entry)
+
+    def remove(self, key):
+        del self.maps[key]
+        self.append({"remove": [list(key[0]), list(key[1])]})
+
+    def append(self, entry):
+        self.file.write(json.dumps(dict(time=time.time(), **entry), ensure_ascii=False) + "\n")
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def session(self):
+        """returns the recorded state as a session JSON object"""
+        return journal_session(self.maps)
+
+    def compact(self, filename=None, compact=False, tables=False, restart=False):
+        """writes the recorded state to a session file, optionally restarting the journal from it
+
+        :optional param filename (String): The session file to write, default None to only restart the journal
+        :optional param compact (Boolean): Write the file without indentation, default False
+        :optional param tables (Boolean): Write the file with device and signal tables, default False
+        :optional param restart (Boolean): Replace the journal with one that only adds the current maps, default False. Earlier states can no longer be replayed.
+        :return (Dict): The session JSON object
+        """
+        session = self.session()
+        if filename:
+            write_session_file(filename, session, compact, tables)
+            logger.info("compacted %s into %s", self.filename, filename)
+        if restart:
+            directory, name = os.path.split(os.path.abspath(self.filename))
+            fd, temp_name = tempfile.mkstemp(suffix=journal_extension, prefix="." + name + ".", dir=directory)
+            os.close(fd)
+            self.file.close()
+            self.file = open(temp_name, 'w', encoding="utf-8")
+            try:
+                self.append({"journal": current_fileversion})
+                for record in self.maps.values():
+                    self.append({"add": record})
+                self.file.close()
+                os.replace(temp_name, self.filename)
+            except BaseException:
+                self.file.close()
+                os.unlink(temp_name)
+                raise
+            finally:
+                self.file = open(self.filename, 'a', encoding="utf-8")
+        return session
+
+def record(filename, graph=None, session_filename=None, interval=60.0, fsync=False):
+    """records changes to the maps on the network in a session journal until stopped
+
+    :param filename (String): The journal file, ending in '.journal'. An existing journal is appended to.
+    :optional param graph (libmapper Graph object): A previously-allocated libmapper graph object to use. If not provided one will be allocated and synced.
+    :optional param session_filename (String): Compact the journal into this session file every 'interval' seconds and when stopped, default None
+    :optional param interval (Float): Seconds between compactions, default 60
+    :optional param fsync (Boolean): Sync every record to disk as well as flushing it, default False
+    :return (None): Blocks while recording, should CTL+C to stop
+    """
+    graph = check_graph(graph)
+    install_stop_handlers()
+    journal = SessionJournal(filename, graph, fsync).start()
+    logger.info("recording map changes to %s", filename)
+    next_compaction = time.monotonic() + interval
+    try:
+        while not stop_session:
+            graph.poll(100)
+            if session_filename and time.monotonic() >= next_compaction:
+                journal.compact(session_filename)
+                next_compaction = time.monotonic() + interval
+    finally:
+        if session_filename:
+            journal.compact(session_filename)
+        journal.close()
+
+# Folds the records of a journal into session map records keyed by map_record_key(), up to time 'until'
+def replay_maps(filename, until=None):
+    maps = {}
+    with open(filename, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # most likely the last record of a journal that was being written during a crash
+                logger.warning("skipping unreadable record on line %d of %s", number, filename)
+                continue
+            if until is not None and entry.get("time", 0) > until:
+                break
+            if "add" in entry:
+                maps[map_record_key(entry["add"])] = entry["add"]
+            elif "modify" in entry:
+                key = (tuple(entry["modify"][0]), tuple(entry["modify"][1]))
+                if key in maps:
+                    record = dict(maps[key])
+                    record.update(entry["set"])
+                    for k in entry.get("unset", []):
+                        record.pop(k, None)
+                    maps[key] = record
+            elif "remove" in entry:
+                maps.pop((tuple(entry["remove"][0]), tuple(entry["remove"][1])), None)
+    return maps
+
+def journal_session(maps):
+    return {"fileversion": current_fileversion, "description": "", "values": [], "views": [],
+            "maps": list(maps.values())}
+
+def replay_journal(filename, until=None):
+    """returns the session recorded in a journal, as it was at a point in time
+
+    :param filename (String): The journal file
+    :optional param until (Float): Time in seconds since the epoch, default None for the latest recorded state
+    :return (Dict): The session JSON object
+    """
+    return journal_session(replay_maps(filename, until))
+
+def compact_journal(filename, session_filename, until=None, compact=False, tables=False):
+    """folds a journal into a session file, see replay_journal()
+
+    :param filename (String): The journal file
+    :param session_filename (String): The session file to write
+    :optional param until (Float): Time in seconds since the epoch, default None for the latest recorded state
+    :optional param compact (Boolean): Write the file without indentation, default False
+    :optional param tables (Boolean): Write the file with device and signal tables, default False
+    :return (Dict): The session JSON object
+    """
+    session = replay_journal(filename, until)
+    write_session_file(session_filename, session, compact, tables)
+    logger.info("compacted %s into %s", filename, session_filename)
+    return session
+
+def write_session_file(filename, session, compact=False, tables=False):
+    if tables:
+        session = encode_tables(session)
+    with replace_session_file(filename) as f:
+        write_session(f, session, session["maps"], None if compact else 4)
+
+class SignalIndex:
+    """Name index of the devices and signals on a graph.
+
+    The index is built once from the graph and then kept up to date from libmapper graph
+    callbacks, so signal matching doesn't need to query the whole graph for every endpoint.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        # device name -> device
+        self.devices = {}
+        # signal name -> {device name: signal}
+        self.signals = {}
+        # incremented whenever devices or signals change, so results derived from the index can be cached
+        self.version = 0
+        for dev in graph.devices():
+            self.add_device(dev)
+        for sig in graph.signals():
+            self.add_signal(sig)
+        add_graph_handler(graph, self.on_graph_event, mpr.Type.DEVICE | mpr.Type.SIGNAL)
+
+    def close(self):
+        remove_graph_handler(self.on_graph_event)
+
+    def add_device(self, dev):
+        self.devices[dev[mpr.Property.NAME]] = dev
+
+    def remove_device(self, dev):
+        dev_name = dev[mpr.Property.NAME]
+        self.devices.pop(dev_name, None)
+        for sigs in self.signals.values():
+            sigs.pop(dev_name, None)
+
+    def add_signal(self, sig):
+        dev = sig.device()
+        dev_name = dev[mpr.Property.NAME]
+        if dev_name not in self.devices:
+            self.devices[dev_name] = dev
+        self.signals.setdefault(sig[mpr.Property.NAME], {})[dev_name] = sig
+
+    def remove_signal(self, sig):
+        sigs = self.signals.get(sig[mpr.Property.NAME])
+        if sigs:
+            sigs.pop(sig.device()[mpr.Property.NAME], None)
+
+    def on_graph_event(self, type, obj, event):
+        removed = event == mpr.Graph.Event.REMOVED or event == mpr.Graph.Event.EXPIRED
+        self.version += 1
+        if type == mpr.Type.DEVICE:
+            self.remove_device(obj) if removed else self.add_device(obj)
+        else:
+            self.remove_signal(obj) if removed else self.add_signal(obj)
+
+    def device(self, name):
+        """returns the named device, or None if it is missing or hidden"""
+        dev = self.devices.get(name)
+        if dev is None or dev['hidden']:
+            return None
+        return dev
+
+    def find(self, sig_name, dev_name=None):
+        """returns the visible signals with a matching name, optionally restricted to one device"""
+        sigs = self.signals.get(sig_name)
+        if not sigs:
+            return []
+        if dev_name is not None:
+            sig = sigs.get(dev_name)
+            return [sig] if sig is not None and self.device(dev_name) else []
+        return [sig for dev_name, sig in sigs.items() if self.device(dev_name)]
+
+def get_sig_index(graph):
+    """returns the signal index for a graph, building it if the graph hasn't been indexed yet"""
+    return get_manager(graph).get_sig_index()
+
+class SessionTagIndex:
+    """Index of the maps on a graph by session tag.
+
+    Like SignalIndex the index is built once and then kept up to date from libmapper graph
+    callbacks, so listing tags or finding the maps with a tag doesn't need to visit every map.
+    Maps connected to hidden devices are not indexed.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        # tag -> {map id: map}
+        self.maps = {}
+        # map id -> tags
+        self.map_tags = {}
+        for map in graph.maps():
+            self.update_map(map)
+        add_graph_handler(graph, self.on_graph_event, mpr.Type.MAP)
+
+    def close(self):
+        remove_graph_handler(self.on_graph_event)
+
+    def update_map(self, map):
+        """re-indexes a map after its session tags may have changed"""
+        if any([sig.device()["hidden"] for sig in map.signals()]):
+            return
+        map_id = map['id']
+        tags = map['session']
+        if tags is None:
+            tags = set()
+        elif isinstance(tags, list):
+            tags = set(tags)
+        else:
+            tags = {tags}
+        old_tags = self.map_tags.get(map_id, set())
+        for tag in old_tags - tags:
+            self.remove_tag(tag, map_id)
+        for tag in tags:
+            self.maps.setdefault(tag, {})[map_id] = map
+        self.map_tags[map_id] = tags
+
+    def remove_map(self, map):
+        map_id = map['id']
+        for tag in self.map_tags.pop(map_id, set()):
+            self.remove_tag(tag, map_id)
+
+    def remove_tag(self, tag, map_id):
+        maps = self.maps.get(tag)
+        if maps is not None:
+            maps.pop(map_id, None)
+            if not maps:
+                del self.maps[tag]
+
+    def on_graph_event(self, type, obj, event):
+        if event == mpr.Graph.Event.REMOVED or event == mpr.Graph.Event.EXPIRED:
+            self.remove_map(obj)
+        else:
+            self.update_map(obj)
+
+    def tagged(self, tag):
+        """returns the maps with a session tag"""
+        return list(self.maps.get(tag, {}).values())
+
+    def counts(self):
+        """returns the number of maps with each session tag"""
+        return {tag: len(maps) for tag, maps in self.maps.items()}
+
+def get_tag_index(graph):
+    """returns the session tag index for a graph, building it if the graph hasn't been indexed yet"""
+    return get_manager(graph).get_tag_index()
+
+def update_tag_index(graph, map):
+    """updates the session tag index after changing a map's tags, if the graph has been indexed"""
+    get_manager(graph).update_tag_index(map)
+
+class DeviceMatcher:
+    """Compiled device_map rules, translating device names in a session to devices on the network.
+
+    Keys of the device_map are the device names used in a session file:
+      - a plain name ('synth.1') matches that device only
+      - a glob ('synth.*', 'host?-*') matches device names using fnmatch rules
+      - a regular expression prefixed with 're:' ('re:(\\w+)\\.(\\d+)') matches whole device names
+    Exact names are looked up first, then patterns are tried in order until one matches.
+
+    Values are the device names to use on the network. They may contain the placeholders {name},
+    {base} and {ordinal} for the session device name and its parts ('synth' and '1' for 'synth.1'),
+    and {ordinal+N} or {ordinal-N} to shift a numeric ordinal. Regular expression groups can be
+    used as in re.sub() ('\\1'). If the result is itself a glob it selects every matching device on
+    the network. Session devices that don't match any rule are not mapped.
+    """
+
+    def __init__(self, device_map):
+        self.exact = {}
+        self.rules = []
+        for key, target in device_map.items():
+            if not isinstance(key, str) or not isinstance(target, str):
+                raise ValueError("device_map keys and values must be strings, got {0!r}: {1!r}".format(key, target))
+            try:
+                if key.startswith("re:"):
+                    self.rules.append((re.compile(key[3:]), target, True))
+                elif is_glob(key):
+                    self.rules.append((re.compile(fnmatch.translate(key)), target, False))
+                else:
+                    self.exact[key] = target
+            except re.error as err:
+                raise ValueError("invalid device_map pattern '{0}': {1}".format(key, err))
+            if is_glob(target):
+                # fail early on targets that can't be compiled
+                fnmatch.translate(target)
+        # session device name -> network device names, valid for one version of a signal index
+        self.resolved = {}
+        self.index = None
+        self.version = None
+
+    def target(self, dev_name):
+        """returns the network device name or glob for a session device name, or None if no rule matches"""
+        target = self.exact.get(dev_name)
+        if target is not None:
+            return expand_device_name(target, dev_name)
+        for pattern, target, is_regex in self.rules:
+            match = pattern.fullmatch(dev_name)
+            if match is None:
+                continue
+            try:
+                if is_regex:
+                    target = match.expand(target)
+                return expand_device_name(target, dev_name)
+            except (re.error, IndexError, ValueError) as err:
+                logger.debug("device_map rule '%s' doesn't apply to '%s': %s", pattern.pattern, dev_name, err)
+        return None
+
+    def devices(self, dev_name, index):
+        """returns the names of the devices in 'index' that a session device name maps to"""
+        if self.index is not index or self.version != index.version:
+            self.resolved = {}
+            self.index = index
+            self.version = index.version
+        names = self.resolved.get(dev_name)
+        if names is None:
+            target = self.target(dev_name)
+            if target is None:
+                names = []
+            elif is_glob(target):
+                pattern = re.compile(fnmatch.translate(target))
+                names = sorted(name for name in index.devices if pattern.match(name))
+            else:
+                names = [target]
+            self.resolved[dev_name] = names
+        return names
+
+def compile_device_map(device_map):
+    """compiles a device_map dictionary into a DeviceMatcher, see DeviceMatcher for the rules
+
+    :param device_map (Dict or DeviceMatcher): The device_map to compile, returned unchanged if already compiled
+    :return (DeviceMatcher): The compiled rules, or None if device_map is None
+    :raises ValueError: If a rule is not a string or a pattern is invalid
+    """
+    if device_map is None or isinstance(device_map, DeviceMatcher):
+        return device_map
+    return DeviceMatcher(device_map)
+
+def is_glob(name):
+    return any(c in name for c in "*?[")
+
+device_name_fields = re.compile(r"\{(name|base|ordinal)([+-]\d+)?\}")
+
+# Substitutes the {name}, {base} and {ordinal} placeholders of a device_map target
+def expand_device_name(target, dev_name):
+    if '{' not in target:
+        return target
+    base, _, ordinal = dev_name.rpartition('.')
+    if not base:
+        base, ordinal = dev_name, ""
+
+    def field(match):
+        if match.group(1) == "name":
+            return dev_name
+        if match.group(1) == "base":
+            return base
+        if match.group(2):
+            if not ordinal.isdigit():
+                raise ValueError("device has no numeric ordinal")
+            return str(int(ordinal) + int(match.group(2)))
+        return ordinal
+    return device_name_fields.sub(field, target)
+
+# Returns a find_sigs() function for the given options that only searches for each name once
+def signal_finder(graph, device_map=None, index=None):
+    found = {}
+    device_map = compile_device_map(device_map)
+
+    def find(fullname):
+        sigs = found.get(fullname)
+        if sigs is None:
+            sigs = found[fullname] = find_sigs(graph, fullname, device_map, index)
+        return sigs
+    return find
+
+def find_sigs(graph, fullname, device_map=None, index=None):
     names = fullname.split('/', 1)
 
     '''
-    If device_map dictionary is provided we will attempt to match the exact device name, otherwise
-    we substitute a wildcard for the device name and return an array of all matching signals.
+    If a device_map is provided we only match the devices its rules translate the device name to (see
+    DeviceMatcher), otherwise we substitute a wildcard for the device name and return an array of all
+    matching signals.
     '''
 
+    if index is None:
+        index = get_sig_index(graph)
     ret = []
 
     if device_map == None:
-        print("searching for wildcard match with device:signal name '*:{0}'".format(names[1]))
-        sigs = graph.signals().filter(mpr.Property.NAME, names[1])
-        for sig in sigs:
-            if not sig.device()['hidden']:
-                print("  found '{0}:{1}'".format(sig.device()['name'], names[1]))
-                ret.append(sig)
-    elif names[0] in device_map:
-        names[0] = device_map[names[0]]
-        print("searching for exact match with device:signal name '{0}:{1}'".format(names[0], names[1]))
-        dev = graph.devices().filter(mpr.Property.NAME, names[0])
-        if dev and not dev['hidden']:
-            sig = dev.next().signals().filter(mpr.Property.NAME, names[1])
-            if sig:
-                ret = [sig.next()]
+        logger.debug("searching for wildcard match with device:signal name '*:%s'", names[1])
+        ret = index.find(names[1])
+        if logger.isEnabledFor(logging.DEBUG):
+            for sig in ret:
+                logger.debug("  found '%s:%s'", sig.device()['name'], names[1])
+    else:
+        for dev_name in compile_device_map(device_map).devices(names[0], index):
+            logger.debug("searching for exact match with device:signal name '%s:%s'", dev_name, names[1])
+            ret.extend(index.find(names[1], dev_name))
 
     return ret
@@ -0,0 +1,245 @@
+import asyncio
+import functools
+import libmapper as mpr
+from . import mappersession as session
+from .mappersession import (check_graph, prepare_file, expire_maps, print_report, match_policies, session_name,
+                            logger, add_graph_handler, remove_graph_handler, SessionStats, SessionManager, compile_device_map)
+
+class SessionService:
+    """An asyncio service for loading, unloading and saving sessions.
+
+    The service polls the libmapper graph from the event loop instead of blocking in a poll loop, and
+    runs requests one at a time from a queue. A load or unload request for a session that is still
+    waiting in the queue replaces the earlier request, so rapidly toggling a session only applies its
+    final state. Session files are parsed and validated in an executor, and maps are verified by
+    waiting on the event loop, so other tasks keep running while a large session loads. The service
+    uses its own SessionManager for the graph, so the sessions it loads are independent of those
+    loaded by the mappersession functions on other graphs.
+
+    Example:
+        async with SessionService() as service:
+            views, values = await service.load("session1.json")
+            await service.unload("session1.json")
+    """
+
+    def __init__(self, graph=None, poll_interval=0.05):
+        """
+        :optional param graph (libmapper Graph object): A previously-allocated libmapper graph object to use. If not provided one will be allocated when the service starts.
+        :optional param poll_interval (Float): Seconds between polls of the graph, default 0.05
+        """
+        self.graph = graph
+        self.manager = None
+        self.poll_interval = poll_interval
+        self.device = None
+        # queued requests, keyed so that requests for the same session replace each other
+        self.requests = {}
+        self.wakeup = None
+        self.tasks = []
+
+    async def start(self):
+        """starts polling the graph and processing requests
+
+        A graph allocated by the service is synced first, see mappersession.set_sync()
+        """
+        owned = not self.graph
+        self.graph = check_graph(self.graph, sync=False)
+        self.manager = SessionManager(self.graph)
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.create_task(self.poll())]
+        if owned:
+            await self.sync()
+        self.tasks.append(asyncio.create_task(self.process()))
+        return self
+
+    # Waits while the graph is polled until nothing has appeared or changed on it for a while, as
+    # mappersession.sync_graph() does without blocking the event loop
+    async def sync(self):
+        loop = asyncio.get_running_loop()
+        start = last_event = loop.time()
+
+        def on_event(type, obj, event):
+            nonlocal last_event
+            last_event = loop.time()
+
+        logger.info('syncing graph...')
+        add_graph_handler(self.graph, on_event, mpr.Type.DEVICE | mpr.Type.SIGNAL | mpr.Type.MAP)
+        try:
+            while True:
+                now = loop.time()
+                settled = now - last_event >= session.sync_quiet
+                if settled or now - start >= session.sync_timeout:
+                    break
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            remove_graph_handler(on_event)
+        if not settled:
+            logger.warning("graph sync stopped after %.1f seconds before the network was quiet, some devices may be "
+                           "missing", loop.time() - start)
+
+    async def stop(self):
+        """stops the service, cancelling any queued requests"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for key, (operation, args, futures) in self.requests.items():
+            for future, future_operation, replaced in futures:
+                future.cancel()
+        self.requests = {}
+        if self.device is not None:
+            self.device.free()
+            self.device = None
+        if self.manager is not None:
+            self.manager.close()
+            self.manager = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def load(self, filename, validate=True, device_map=None, reconcile=False, release=False, match="all",
+                   max_fanout=256, timeout=1.0):
+        """loads a session file, see mappersession.load() for the options
+
+        :optional param timeout (Float): Seconds to wait for new maps to become active, default 1.0
+        :return (Tuple): views and values of the session, or (None, None) if it failed to load or was
+            replaced by a later unload of the session. See mappersession.last_stats() for timings.
+        """
+        if match not in match_policies:
+            raise ValueError("unknown match policy '{0}', expected one of {1}".format(match, match_policies))
+        device_map = compile_device_map(device_map)
+        return await self.request(("session", session_name(filename)), self.do_load, filename, validate, device_map,
+                                  reconcile, release, match, max_fanout, timeout, replaced=(None, None))
+
+    async def unload(self, filename):
+        """unloads a session file, see mappersession.unload()
+
+        :return (SessionStats): Timings and counts of the unload, or None if it was replaced by a later load
+            of the session
+        """
+        return await self.request(("session", session_name(filename)), self.do_unload, filename, replaced=None)
+
+    async def save(self, filename, description="", values=[], views=[], compact=False, stream=False, tables=False,
+                   devices=None, signals=None, tag=None, incremental=False):
+        """saves the current mapping state to a session file, see mappersession.save() for the options
+
+        :return (Dict): The session JSON object
+        """
+        return await self.request(("save", filename), self.do_save, filename, description, values, views, compact,
+                                  stream, tables, devices, signals, tag, incremental)
+
+    async def clear(self, tag=None):
+        """clears maps on the network, see mappersession.clear()
+
+        :return (SessionStats): Timings and counts of the clear
+        """
+        return await self.request(("clear", tag), self.do_clear, tag)
+
+    def add_control_signals(self, filenames):
+        """creates a 'mappersession' device with a signal for each session file
+
+        Setting a signal to a non-zero value queues a load of its file and setting it to zero queues
+        an unload, as in mappersession's interactive mode.
+        """
+        if self.device is None:
+            self.device = mpr.Device("mappersession", self.graph)
+        for filename in filenames:
+            sig = self.device.add_signal(mpr.Signal.Direction.INCOMING, session_name(filename), 1, mpr.Type.INT32,
+                                         None, 0, 1, None)
+            sig.set_property("filename", filename, publish=False)
+            sig.set_callback(self.on_control_signal, mpr.Signal.Event.REMOTE_UPDATE)
+
+    def on_control_signal(self, sig, event, id, val, time):
+        filename = sig['filename']
+        if val == 0:
+            logger.info('unloading %s', filename)
+            task = asyncio.ensure_future(self.unload(filename))
+        else:
+            logger.info('loading %s', filename)
+            task = asyncio.ensure_future(self.load(filename))
+        task.add_done_callback(self.report_error)
+
+    def report_error(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("error: %s", task.exception())
+
+    # Queues a request, replacing any queued request with the same key
+    # Futures of replaced requests for the same operation resolve with the result of the request that runs,
+    # and those of other operations with their 'replaced' result, e.g. (None, None) for a replaced load
+    def request(self, key, operation, *args, replaced=None):
+        future = asyncio.get_running_loop().create_future()
+        futures = [(future, operation, replaced)]
+        if key in self.requests:
+            futures = self.requests.pop(key)[2] + futures
+        self.requests[key] = (operation, args, futures)
+        self.wakeup.set()
+        return future
+
+    async def poll(self):
+        while True:
+            # skip polls while a save holds the manager's lock in the executor
+            if self.manager.lock.acquire(blocking=False):
+                try:
+                    self.graph.poll(0)
+                    if self.device is not None:
+                        self.device.poll(0)
+                finally:
+                    self.manager.lock.release()
+            await asyncio.sleep(self.poll_interval)
+
+    async def process(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.requests:
+                key = next(iter(self.requests))
+                operation, args, futures = self.requests.pop(key)
+                try:
+                    result = await operation(*args)
+                except Exception as err:
+                    for future, future_operation, replaced in futures:
+                        if not future.done():
+                            if future_operation == operation:
+                                future.set_exception(err)
+                            else:
+                                future.set_result(replaced)
+                else:
+                    for future, future_operation, replaced in futures:
+                        if not future.done():
+                            future.set_result(result if future_operation == operation else replaced)
+
+    async def do_load(self, filename, validate, device_map, reconcile, release, match, max_fanout, timeout):
+        loop = asyncio.get_running_loop()
+        stats = SessionStats("load")
+        session_json = await loop.run_in_executor(None, prepare_file, filename, validate, stats)
+        if session_json is None:
+            stats.finish()
+            return None, None
+        maps = session_json["maps"]
+        stats.count("session_maps", len(maps))
+        report, pending = self.manager.create_maps(maps, device_map, reconcile, release, match, max_fanout, stats)
+        with stats.phase("verify"):
+            deadline = loop.time() + timeout
+            while pending and loop.time() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                pending = self.manager.check_maps(pending, report)
+            expire_maps(pending, report, stats)
+        stats.add_report(report)
+        print_report(report, len(maps))
+        stats.finish()
+        return session_json["views"], session_json["values"]
+
+    async def do_unload(self, filename):
+        return self.manager.unload(filename)
+
+    async def do_save(self, filename, description, values, views, compact, stream, tables, devices, signals, tag,
+                      incremental):
+        # the manager holds its lock while saving, so the graph isn't polled from the event loop meanwhile
+        save = functools.partial(self.manager.save, filename, description, values, "", views, compact, stream,
+                                 tables, devices, signals, tag, incremental)
+        return await asyncio.get_running_loop().run_in_executor(None, save)
+
+    async def do_clear(self, tag):
+        return self.manager.clear(tag)
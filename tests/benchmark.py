@@ -0,0 +1,144 @@
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+try:
+    import mappersession as session
+except:
+    try:
+        sys.path.append(
+                        os.path.join(os.path.join(os.getcwd(),
+                                                  os.path.dirname(sys.argv[0])),
+                                     '../src/mappersession'))
+        import mappersession as session
+    except:
+        print('Error importing mappersession module.')
+        sys.exit(1)
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import fake_libmapper as mpr
+
+# Run mappersession against the in-process stand-in for libmapper
+module = sys.modules[session.save.__module__]
+module.mpr = mpr
+
+def make_graph(num_signals, sigs_per_device=100):
+    """creates a fake graph with devices that each have half outputs and half inputs"""
+    graph = mpr.Graph()
+    outs = []
+    ins = []
+    for d in range(max(1, num_signals // sigs_per_device)):
+        dev = graph.add_device("dev{0}.1".format(d))
+        for s in range(sigs_per_device // 2):
+            outs.append(dev.add_signal("out{0}_{1}".format(d, s), mpr.Type.SIGNAL_OUT))
+            ins.append(dev.add_signal("in{0}_{1}".format(d, s), mpr.Type.SIGNAL_IN))
+    graph.poll()
+    return graph, outs, ins
+
+def make_session(outs, ins, num_maps, num_tags, seed=0):
+    """creates a session JSON Dict with maps between random signals"""
+    rand = random.Random(seed)
+    maps = []
+    for i in range(num_maps):
+        srcs = rand.sample(outs, 2 if i % 10 == 0 else 1)
+        dst = rand.choice(ins)
+        maps.append({
+            "sources": [sig.device()['name'] + "/" + sig['name'] for sig in srcs],
+            "destinations": [dst.device()['name'] + "/" + dst['name']],
+            "expression": "y=x$0+x$1" if len(srcs) > 1 else "y=x*2",
+            "muted": False,
+            "process_loc": "SOURCE",
+            "protocol": "UDP",
+            "scope": [sig.device()['name'] for sig in srcs],
+            "use_inst": False,
+            "version": 0,
+            "session": "tag{0}".format(i % num_tags)
+        })
+    return {"fileversion": module.current_fileversion, "description": "benchmark", "values": [], "views": [], "maps": maps}
+
+def make_legacy_session(current):
+    """converts a current session into a version 2.3 session"""
+    maps = []
+    for map in current["maps"]:
+        maps.append({"sources": [{"name": name} for name in map["sources"]],
+                     "destinations": [{"name": name} for name in map["destinations"]],
+                     "expression": map["expression"].replace("x$", "src[").replace("y", "dst[0]"),
+                     "muted": False})
+    return {"fileversion": "2.3", "mapping": {"maps": maps}}
+
+def populate(graph, session_json):
+    """creates the maps of a session, keeping their session tags"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        session.load_json(copy.deepcopy(session_json), validate=False, graph=graph)
+
+def timed(func, setup, repeat):
+    """runs 'func' on the result of 'setup' 'repeat' times, returning timing statistics in seconds"""
+    times = []
+    for i in range(repeat):
+        arg = setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func(arg)
+            times.append(time.perf_counter() - start)
+    return {"min": min(times), "mean": sum(times) / len(times), "runs": repeat}
+
+def run(args):
+    results = {}
+
+    graph, outs, ins = make_graph(args.signals)
+    session_json = make_session(outs, ins, args.maps, args.tags)
+    legacy_json = make_legacy_session(session_json)
+
+    # Loading
+    def fresh_graph():
+        return make_graph(args.signals)[0], copy.deepcopy(session_json)
+    results["load_json"] = timed(lambda a: session.load_json(a[1], "bench", graph=a[0]), fresh_graph, args.repeat)
+    results["load_json_unvalidated"] = timed(lambda a: session.load_json(a[1], "bench", graph=a[0], validate=False),
+                                             fresh_graph, args.repeat)
+    results["try_make_maps"] = timed(lambda a: module.try_make_maps(a[0], a[1]["maps"]), fresh_graph, args.repeat)
+    results["upgrade_json"] = timed(module.upgrade_json, lambda: copy.deepcopy(legacy_json), args.repeat)
+
+    # Saving and querying a populated graph
+    populate(graph, session_json)
+    results["save"] = timed(lambda g: session.save(graph=g), lambda: graph, args.repeat)
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "bench.json")
+    results["save_file"] = timed(lambda g: session.save(path, graph=g, stream=True), lambda: graph, args.repeat)
+    os.remove(path)
+    os.rmdir(tmpdir)
+    results["tags"] = timed(lambda g: session.tags(g), lambda: graph, args.repeat)
+
+    # Clearing
+    def populated_graph():
+        g = make_graph(args.signals)[0]
+        populate(g, session_json)
+        return g
+    results["clear_tag"] = timed(lambda g: session.clear("tag0", g), populated_graph, args.repeat)
+    results["clear"] = timed(lambda g: session.clear(graph=g), populated_graph, args.repeat)
+
+    return {"params": {"signals": args.signals, "maps": args.maps, "tags": args.tags, "repeat": args.repeat},
+            "results": results}
+
+# Benchmarks mappersession operations against a synthetic in-process graph, no network required
+# Prints the results as JSON, e.g. 'python benchmark.py --maps 5000 --output results.json'
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark mappersession against a fake libmapper graph")
+    parser.add_argument('--signals', type=int, default=10000, help="Number of signals in the graph")
+    parser.add_argument('--maps', type=int, default=5000, help="Number of maps in the session")
+    parser.add_argument('--tags', type=int, default=100, help="Number of session tags")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of runs of each benchmark")
+    parser.add_argument('--output', metavar='PATH', help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,254 @@
+"""An in-process stand-in for the parts of the libmapper API used by mappersession.
+
+Graphs are populated directly with add_device() and Device.add_signal(), and maps become active as
+soon as they are pushed, so mappersession can be exercised and timed without a network or live
+devices. Graph callbacks are queued and delivered on the next poll(), as in libmapper. As in the
+libmapper Python binding, graph callbacks are process-wide: the events of every graph are delivered
+to the callbacks added on any graph, so callbacks have to check the graph of the object they receive,
+and adding or removing a callback while a poll is delivering events raises a RuntimeError.
+"""
+
+from enum import Enum, IntFlag
+import itertools
+
+class Property(Enum):
+    NAME = 'name'
+    EXPRESSION = 'expr'
+    MUTED = 'muted'
+    PROCESS_LOCATION = 'process_loc'
+    PROTOCOL = 'protocol'
+    STATUS = 'status'
+    SCOPE = 'scope'
+
+class Type(IntFlag):
+    DEVICE = 0x01
+    SIGNAL_IN = 0x02
+    SIGNAL_OUT = 0x04
+    SIGNAL = 0x06
+    MAP_IN = 0x08
+    MAP_OUT = 0x10
+    MAP = 0x18
+    OBJECT = 0x1F
+
+class Operator(IntFlag):
+    DOES_NOT_EXIST = 0x01
+    EQUAL = 0x02
+    NOT_EQUAL = 0x08
+    ALL = 0x10
+    ANY = 0x20
+
+class Status(IntFlag):
+    UNDEFINED = 0x0000
+    NEW = 0x0001
+    MODIFIED = 0x0002
+    REMOVED = 0x0004
+    EXPIRED = 0x0008
+    STAGED = 0x0010
+    ACTIVE = 0x0020
+
+class Location(IntFlag):
+    SOURCE = 0x01
+    DESTINATION = 0x02
+    ANY = 0x03
+
+class Protocol(Enum):
+    UDP = 1
+    TCP = 2
+
+ids = itertools.count(1)
+
+# Callbacks for all graphs, like the binding's graph_dev_cbs, graph_sig_cbs and graph_map_cbs
+graph_callbacks = {Type.DEVICE: set(), Type.SIGNAL: set(), Type.MAP: set()}
+
+class List(list):
+    """A list of objects supporting the libmapper List query methods that mappersession uses"""
+
+    def filter(self, key, val, op=Operator.EQUAL):
+        def matches(obj):
+            prop = obj[key]
+            if op & Operator.ANY and isinstance(prop, list):
+                return val in prop
+            return prop == val
+        return List(obj for obj in self if matches(obj))
+
+    def next(self):
+        return self[0] if self else None
+
+class Object:
+    Event = Status
+    Status = Status
+
+    def __init__(self, graph, props):
+        self._graph = graph
+        self.props = {'id': next(ids)}
+        self.props.update(props)
+
+    def __getitem__(self, key):
+        return self.props.get(key.value if isinstance(key, Property) else key)
+
+    def __setitem__(self, key, val):
+        self.props[key.value if isinstance(key, Property) else key] = val
+
+    def __eq__(self, other):
+        return isinstance(other, Object) and self.props['id'] == other.props['id']
+
+    def __hash__(self):
+        return self.props['id']
+
+    @property
+    def properties(self):
+        return dict(self.props)
+
+    def graph(self):
+        return self._graph
+
+class Device(Object):
+
+    def __init__(self, graph, name):
+        super().__init__(graph, {'name': name, 'hidden': False})
+        self.sigs = List()
+
+    def signals(self):
+        return List(self.sigs)
+
+    def maps(self, direction=None):
+        return List(map for map in self._graph.map_index.values() if map.dst.dev == self or
+                    any(src.dev == self for src in map.srcs))
+
+    def add_signal(self, name, direction=Type.SIGNAL_OUT):
+        sig = Signal(self, name, direction)
+        self.sigs.append(sig)
+        self._graph.sigs.append(sig)
+        self._graph.notify(Type.SIGNAL, sig, Status.NEW)
+        return sig
+
+class Signal(Object):
+
+    def __init__(self, device, name, direction):
+        super().__init__(device._graph, {'name': name, 'hidden': False, 'direction': direction})
+        self.dev = device
+
+    def device(self):
+        return self.dev
+
+    def maps(self, direction=None):
+        return List(map for map in self._graph.map_index.values() if map.dst == self or self in map.srcs)
+
+class Map(Object):
+    Location = Location
+    Protocol = Protocol
+
+    def __new__(cls, srcs, dst):
+        if not isinstance(srcs, list):
+            srcs = [srcs]
+        srcs = sorted(srcs, key=lambda sig: (sig.dev['name'], sig['name']))
+        graph = dst._graph
+        key = (tuple(sig['id'] for sig in srcs), dst['id'])
+        existing = graph.map_index.get(key) or graph.staged.get(key)
+        if existing is not None:
+            return existing
+        map = super().__new__(cls)
+        Object.__init__(map, graph, {'expr': 'y=x', 'muted': False, 'process_loc': Location.SOURCE,
+                                     'protocol': Protocol.UDP, 'scope': [sig.dev for sig in srcs],
+                                     'status': Status.STAGED, 'use_inst': False, 'version': 0,
+                                     'is_local': False, 'num_sigs_in': len(srcs)})
+        map.srcs = srcs
+        map.dst = dst
+        map.key = key
+        graph.staged[key] = map
+        return map
+
+    def __init__(self, srcs, dst):
+        pass
+
+    def signals(self, loc=Location.ANY):
+        if loc == Location.SOURCE:
+            return List(self.srcs)
+        if loc == Location.DESTINATION:
+            return List([self.dst])
+        return List(self.srcs + [self.dst])
+
+    def index(self, sig, loc=Location.SOURCE):
+        for i, src in enumerate(self.srcs):
+            if src == sig:
+                return i
+        return -1
+
+    def add_scope(self, dev):
+        scope = self.props.get('scope') or []
+        if dev not in scope:
+            self.props['scope'] = scope + [dev]
+
+    @property
+    def ready(self):
+        return bool(self.props['status'] & Status.ACTIVE)
+
+    def push(self):
+        graph = self._graph
+        if self.key in graph.map_index:
+            self.props['version'] += 1
+            graph.notify(Type.MAP, self, Status.MODIFIED)
+        else:
+            self.props['status'] = Status.ACTIVE
+            graph.staged.pop(self.key, None)
+            graph.map_index[self.key] = self
+            graph.notify(Type.MAP, self, Status.NEW)
+        return self
+
+    def release(self):
+        graph = self._graph
+        if graph.map_index.pop(self.key, None) is not None:
+            graph.notify(Type.MAP, self, Status.REMOVED)
+
+class Graph(Object):
+    Event = Status
+
+    def __init__(self, subscribe_flags=Type.OBJECT):
+        super().__init__(self, {})
+        # stands in for the binding's pointer to the C graph, which graph() wrappers share
+        self._obj = self.props['id']
+        self.devs = List()
+        self.sigs = List()
+        self.map_index = {}
+        self.staged = {}
+        self.events = []
+
+    def add_device(self, name):
+        dev = Device(self, name)
+        self.devs.append(dev)
+        self.notify(Type.DEVICE, dev, Status.NEW)
+        return dev
+
+    def notify(self, type, obj, event):
+        self.events.append((type, obj, event))
+
+    def devices(self):
+        return List(self.devs)
+
+    def signals(self):
+        return List(self.sigs)
+
+    def maps(self):
+        return List(self.map_index.values())
+
+    def poll(self, timeout=0):
+        events, self.events = self.events, []
+        for type, obj, event in events:
+            # loops over the live set as the binding does, so callbacks changing during a poll raise
+            for func in graph_callbacks[type]:
+                func(type, obj, event)
+        return self
+
+    def add_callback(self, func, types=Type.OBJECT):
+        for type, funcs in graph_callbacks.items():
+            if types & type:
+                funcs.add(func)
+        return self
+
+    def remove_callback(self, func):
+        for funcs in graph_callbacks.values():
+            funcs.discard(func)
+        return self
+
+    def free(self):
+        pass
@@ -0,0 +1,47 @@
+"""Imports mappersession with fake_libmapper in place of libmapper, for the offline behaviour tests.
+
+Run the tests from the command line (e.g. 'python test_managers.py') or with pytest.
+"""
+
+import os
+import sys
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, tests_dir)
+sys.path.insert(0, os.path.join(tests_dir, '../src'))
+
+import fake_libmapper as mpr
+sys.modules['libmapper'] = mpr
+
+from mappersession import mappersession as session
+from mappersession import service
+
+# Newly allocated graphs are already complete, so don't wait for them to settle
+session.set_sync(0.0, 0.0)
+
+def make_graph(devices):
+    """creates a fake graph from a Dict of device names to lists of (signal name, direction)"""
+    graph = mpr.Graph()
+    for dev_name, sigs in devices.items():
+        add_device(graph, dev_name, sigs)
+    graph.poll()
+    return graph
+
+def add_device(graph, dev_name, sigs):
+    dev = graph.add_device(dev_name)
+    for sig_name, direction in sigs:
+        dev.add_signal(sig_name, mpr.Type.SIGNAL_OUT if direction == "out" else mpr.Type.SIGNAL_IN)
+    return dev
+
+def make_session(maps, fileversion="2.4"):
+    """creates a session JSON Dict from (sources, destination) pairs of full signal names"""
+    return {"fileversion": fileversion, "description": "", "values": [], "views": [],
+            "maps": [{"sources": list(srcs), "destinations": [dst], "expression": "y=x"} for srcs, dst in maps]}
+
+def run_tests(module):
+    """runs the test_ functions of a test module, for running it from the command line"""
+    for name in dir(module):
+        if name.startswith("test_"):
+            getattr(module, name)()
+            print("passed", name)
+    print("Test complete")
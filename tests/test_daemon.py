@@ -0,0 +1,40 @@
+import json
+import os
+import sys
+import tempfile
+from fake_session import session, make_graph, make_session, run_tests
+from mappersession import daemon
+
+# Tests for running commands in the daemon, with the fake libmapper
+
+def test_request_options_apply_to_request():
+    graph = make_graph({"a.1": [("out1", "out")], "b.1": [("in1", "in")]})
+    manager = session.SessionManager(graph)
+    directory = tempfile.mkdtemp()
+    cache = os.path.join(directory, "cache")
+    with open(os.path.join(directory, "session.json"), "w") as f:
+        json.dump(make_session([(["a.1/out1"], "b.1/in1")]), f)
+    seen = {}
+    run_commands = daemon.run_commands
+    def record_settings(session, args, graph):
+        seen["sync"] = (session.sync_quiet, session.sync_timeout)
+        seen["cache"] = session.session_cache
+        run_commands(session, args, graph)
+    daemon.run_commands = record_settings
+    try:
+        response, running = daemon.run_request({"argv": ["--cache", cache, "--sync_timeout", "3", "--load",
+                                                         "session.json"], "cwd": directory}, graph)
+    finally:
+        daemon.run_commands = run_commands
+    assert response["status"] == 0 and running
+    assert seen["sync"] == (0.0, 3.0)
+    assert seen["cache"] is not None and os.listdir(cache)
+    assert len(graph.maps()) == 1
+
+    # the daemon's own settings are restored after the request
+    assert (session.sync_quiet, session.sync_timeout) == (0.0, 0.0)
+    assert session.session_cache is None
+    manager.close()
+
+if __name__ == '__main__':
+    run_tests(sys.modules[__name__])
@@ -0,0 +1,104 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from fake_session import session, mpr, make_graph, make_session, run_tests
+
+# Tests for recording, replaying and compacting session journals, with the fake libmapper
+
+def journal_entries(filename):
+    with open(filename) as f:
+        return [json.loads(line) for line in f]
+
+def expressions(session_json):
+    return {map["destinations"][0]: map["expression"] for map in session_json["maps"]}
+
+def test_record_and_replay():
+    graph = make_graph({"a.1": [("out1", "out"), ("out2", "out")], "b.1": [("in1", "in"), ("in2", "in")]})
+    manager = session.SessionManager(graph)
+    manager.load_json(make_session([(["a.1/out1"], "b.1/in1")]), "first")
+    filename = os.path.join(tempfile.mkdtemp(), "studio.journal")
+    journal = session.SessionJournal(filename, graph).start()
+
+    # each change is recorded as it is polled, with a pause so that the records have different times
+    def change(operation):
+        time.sleep(0.01)
+        with manager.lock:
+            operation()
+            graph.poll()
+    change(lambda: manager.load_json(make_session([(["a.1/out2"], "b.1/in2")]), "second"))
+    map = [map for map in graph.maps() if map.signals(mpr.Map.Location.DESTINATION)[0]["name"] == "in1"][0]
+    def modify():
+        map[mpr.Property.EXPRESSION] = "y=5*x"
+        map.push()
+    change(modify)
+    change(map.release)
+    journal.close()
+
+    entries = journal_entries(filename)
+    assert "journal" in entries[0]
+    kinds = [next(key for key in ("add", "modify", "remove") if key in entry) for entry in entries[1:]]
+    assert kinds == ["add", "add", "modify", "remove"]
+    # modifications only record what changed
+    assert entries[3]["set"]["expression"] == "y=5*x" and "sources" not in entries[3]["set"]
+
+    # replaying stops at any recorded time
+    assert expressions(session.replay_journal(filename)) == {"b.1/in2": "y=x"}
+    assert expressions(session.replay_journal(filename, until=entries[3]["time"])) == {"b.1/in1": "y=5*x",
+                                                                                      "b.1/in2": "y=x"}
+    assert expressions(session.replay_journal(filename, until=entries[1]["time"])) == {"b.1/in1": "y=x"}
+    manager.close()
+
+def test_restart_records_differences():
+    graph = make_graph({"a.1": [("out1", "out"), ("out2", "out")], "b.1": [("in1", "in"), ("in2", "in")]})
+    manager = session.SessionManager(graph)
+    manager.load_json(make_session([(["a.1/out1"], "b.1/in1")]), "first")
+    filename = os.path.join(tempfile.mkdtemp(), "studio.journal")
+    session.SessionJournal(filename, graph).start().close()
+
+    # changes made while not recording are recorded when the journal is started again
+    with manager.lock:
+        manager.unload("first")
+        manager.load_json(make_session([(["a.1/out2"], "b.1/in2")]), "second")
+    journal = session.SessionJournal(filename, graph).start()
+    journal.close()
+    entries = journal_entries(filename)
+    assert len([entry for entry in entries if "journal" in entry]) == 1
+    assert "remove" in entries[-2] and "add" in entries[-1]
+    assert expressions(session.replay_journal(filename)) == {"b.1/in2": "y=x"}
+
+    # an unreadable last record, e.g. from a crash, is skipped
+    with open(filename, "a") as f:
+        f.write('{"time": ')
+    assert expressions(session.replay_journal(filename)) == {"b.1/in2": "y=x"}
+    manager.close()
+
+def test_compact():
+    graph = make_graph({"a.1": [("out1", "out"), ("out2", "out")], "b.1": [("in1", "in"), ("in2", "in")]})
+    manager = session.SessionManager(graph)
+    manager.load_json(make_session([(["a.1/out1"], "b.1/in1"), (["a.1/out2"], "b.1/in2")]), "first")
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "studio.journal")
+    journal = session.SessionJournal(filename, graph).start()
+    with manager.lock:
+        graph.maps()[0].release()
+        graph.poll()
+
+    compacted = os.path.join(directory, "studio.json")
+    journal.compact(compacted, restart=True)
+    journal.close()
+    assert len(journal_entries(filename)) == 2
+    assert session.prepare_file(compacted) is not None
+    assert session.compact_journal(filename, os.path.join(directory, "replayed.json"))["maps"] == \
+        session.replay_journal(filename)["maps"]
+
+    # compacted sessions and journals load like other session files
+    graph.maps()[0].release()
+    graph.poll()
+    manager.load(filename)
+    assert len(graph.maps()) == 1
+    manager.close()
+
+if __name__ == '__main__':
+    run_tests(sys.modules[__name__])
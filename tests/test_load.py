@@ -0,0 +1,138 @@
+import json
+import os
+import sys
+import tempfile
+from fake_session import session, mpr, make_graph, make_session, run_tests
+
+# Tests for loading and unloading sessions, with the fake libmapper
+
+def session_file(directory, name, maps, expressions={}):
+    session_json = make_session(maps)
+    for map in session_json["maps"]:
+        map["expression"] = expressions.get(map["destinations"][0], map["expression"])
+    filename = os.path.join(directory, name)
+    with open(filename, "w") as f:
+        json.dump(session_json, f)
+    return filename
+
+def find_map(graph, dst):
+    maps = [map for map in graph.maps() if session.full_name(map.signals(mpr.Map.Location.DESTINATION)[0]) == dst]
+    assert len(maps) <= 1
+    return maps[0] if maps else None
+
+def map_between(graph, src, dst):
+    srcs = session.find_sigs(graph, src)
+    dsts = session.find_sigs(graph, dst)
+    return mpr.Map(srcs[0], dsts[0]).push()
+
+def test_reconcile_and_release():
+    graph = make_graph({"a.1": [("out1", "out"), ("out2", "out")], "b.1": [("in1", "in"), ("in2", "in"),
+                                                                          ("in3", "in")]})
+    existing = map_between(graph, "a.1/out1", "b.1/in1")
+    existing[mpr.Property.EXPRESSION] = "y=2*x"
+    existing.push()
+    extra = map_between(graph, "a.1/out2", "b.1/in3")
+    graph.poll()
+    manager = session.SessionManager(graph)
+    maps = make_session([(["a.1/out1"], "b.1/in1"), (["a.1/out2"], "b.1/in2")])["maps"]
+
+    # existing maps are updated in place instead of being created again
+    report = manager.try_make_maps(maps, reconcile=True, timeout=0)
+    assert len(report["updated"]) == 1 and len(report["created"]) == 1
+    assert find_map(graph, "b.1/in1") is existing and existing[mpr.Property.EXPRESSION] == "y=x"
+    assert len(graph.maps()) == 3
+
+    # unchanged maps aren't pushed again, and maps that aren't in the session are released
+    version = existing["version"]
+    report = manager.try_make_maps(maps, reconcile=True, release=True, timeout=0)
+    assert len(report["unchanged"]) == 2 and report["released"] == [extra]
+    assert existing["version"] == version
+    assert find_map(graph, "b.1/in3") is None and len(graph.maps()) == 2
+    manager.close()
+
+def test_reconcile_saved_session():
+    graph = make_graph({"a.1": [("out1", "out")], "b.1": [("in1", "in")]})
+    manager = session.SessionManager(graph)
+    manager.load_json(make_session([(["a.1/out1"], "b.1/in1")]), "first")
+    filename = os.path.join(tempfile.mkdtemp(), "saved.json")
+    manager.save(filename)
+    map = graph.maps()[0]
+    version = map["version"]
+
+    # the runtime properties recorded by save() aren't compared or set, so the map is left alone
+    maps = session.prepare_file(filename)["maps"]
+    assert "status" in maps[0] and "version" in maps[0]
+    for i in range(2):
+        report = manager.try_make_maps(maps, reconcile=True, timeout=0)
+        assert len(report["unchanged"]) == 1 and not report["updated"]
+    assert map["version"] == version and map["status"] == mpr.Map.Status.ACTIVE
+    manager.close()
+
+def test_unload_restores_overlapping_sessions():
+    graph = make_graph({"a.1": [("out1", "out"), ("out2", "out")], "b.1": [("in1", "in"), ("in2", "in")]})
+    directory = tempfile.mkdtemp()
+    first = session_file(directory, "first.json", [(["a.1/out1"], "b.1/in1"), (["a.1/out2"], "b.1/in2")])
+    second = session_file(directory, "second.json", [(["a.1/out1"], "b.1/in1")], {"b.1/in1": "y=3*x"})
+    manager = session.SessionManager(graph)
+    manager.load(first)
+    manager.load(second)
+    shared = find_map(graph, "b.1/in1")
+    assert shared[mpr.Property.EXPRESSION] == "y=3*x"
+    assert shared["session"] == ["first", "second"]
+
+    # the shared map goes back to the first session's properties
+    stats = manager.unload(second)
+    assert stats.counts["released"] == 0 and stats.counts["restored"] == 1
+    assert find_map(graph, "b.1/in1") is shared
+    assert shared[mpr.Property.EXPRESSION] == "y=x" and shared["session"] == "first"
+    assert find_map(graph, "b.1/in2") is not None
+
+    # and is released with the last session that uses it
+    manager.unload(first)
+    assert len(graph.maps()) == 0
+    manager.close()
+
+def test_unload_keeps_maps_of_other_sessions():
+    graph = make_graph({"a.1": [("out1", "out"), ("out2", "out")], "b.1": [("in1", "in"), ("in2", "in")]})
+    directory = tempfile.mkdtemp()
+    first = session_file(directory, "first.json", [(["a.1/out1"], "b.1/in1"), (["a.1/out2"], "b.1/in2")])
+    second = session_file(directory, "second.json", [(["a.1/out1"], "b.1/in1")], {"b.1/in1": "y=3*x"})
+    manager = session.SessionManager(graph)
+    manager.load(first)
+    manager.load(second)
+
+    # unloading the first session keeps the second session's version of the shared map
+    manager.unload(first)
+    shared = find_map(graph, "b.1/in1")
+    assert shared[mpr.Property.EXPRESSION] == "y=3*x" and shared["session"] == "second"
+    assert find_map(graph, "b.1/in2") is None
+    manager.close()
+
+def test_unload_keeps_maps_tagged_elsewhere():
+    # 'other' stands in for another process loading sessions on the same network
+    graph = make_graph({"a.1": [("out1", "out")], "b.1": [("in1", "in")]})
+    directory = tempfile.mkdtemp()
+    x = session_file(directory, "x.json", [(["a.1/out1"], "b.1/in1")])
+    s = session_file(directory, "s.json", [(["a.1/out1"], "b.1/in1")])
+    t = session_file(directory, "t.json", [(["a.1/out1"], "b.1/in1")])
+    other = session.SessionManager(graph)
+    manager = session.SessionManager(graph)
+    other.load(x)
+    manager.load(s)
+    manager.load(t)
+    map = find_map(graph, "b.1/in1")
+    assert map["session"] == ["x", "s", "t"]
+
+    # the tags of sessions this manager didn't load are kept
+    manager.unload(s)
+    assert find_map(graph, "b.1/in1") is map and map["session"] == ["x", "t"]
+    stats = manager.unload(t)
+    assert stats.counts["released"] == 0 and stats.counts["untagged"] == 1
+    assert find_map(graph, "b.1/in1") is map and map["session"] == "x"
+    other.unload(x)
+    assert len(graph.maps()) == 0
+    other.close()
+    manager.close()
+
+if __name__ == '__main__':
+    run_tests(sys.modules[__name__])
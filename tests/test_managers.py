@@ -0,0 +1,104 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from fake_session import session, mpr, make_graph, add_device, make_session, run_tests
+
+# Tests for SessionManager and the module functions that use it, with the fake libmapper
+
+def test_graphs_are_independent():
+    # libmapper delivers graph callbacks from every graph, so each manager must ignore the others
+    g1 = make_graph({"dev.1": [("out", "out"), ("in", "in")]})
+    g2 = make_graph({})
+    m1 = session.SessionManager(g1)
+    m2 = session.SessionManager(g2)
+    m1.get_sig_index()
+    m1.get_tag_index()
+
+    add_device(g2, "onlyong2.1", [("out2", "out"), ("in2", "in")])
+    g2.poll()
+    assert m1.get_sig_index().device("onlyong2.1") is None
+    assert m2.get_sig_index().device("onlyong2.1") is not None
+
+    # maps staged on g1 aren't created from signals that appear on g2
+    m1.load_json(make_session([(["late.1/lateout"], "late.1/latein")]), "late", wait=0.3, background=True,
+                 validate=False)
+    add_device(g2, "late.1", [("lateout", "out"), ("latein", "in")])
+    g2.poll()
+    m1.staging_thread.join()
+    assert len(g1.maps()) == 0 and len(g2.maps()) == 0
+    assert m1.list_staged() == []
+
+    # maps loaded and tagged on g2 aren't indexed or owned by the manager of g1
+    m2.load_json(make_session([(["onlyong2.1/out2"], "onlyong2.1/in2")]), "two", validate=False)
+    g2.poll()
+    assert m2.tags() == ["two"] and m1.tags() == []
+    assert len(m2.map_owners) == 1 and len(m1.map_owners) == 0
+
+    # and releasing a map on g2 doesn't disturb the ownership on g1
+    m1.load_json(make_session([(["dev.1/out"], "dev.1/in")]), "one", validate=False)
+    session.unload("two", g2)
+    g2.poll()
+    assert len(m1.map_owners) == 1 and len(g1.maps()) == 1
+    m1.close()
+    m2.close()
+
+def test_handlers_change_during_dispatch():
+    # e.g. one manager starts syncing or staging on another thread while a poll delivers events for
+    # another manager's graph
+    g1 = make_graph({})
+    g2 = make_graph({"dev.2": [("out2", "out"), ("in2", "in")]})
+    m1 = session.SessionManager(g1)
+    m2 = session.SessionManager(g2)
+    m1.get_sig_index()
+
+    def start_other_manager(type, obj, event):
+        session.sync_graph(g2, 0.0, 0.0)
+        m2.get_sig_index()
+    g1.add_callback(start_other_manager, mpr.Type.DEVICE)
+    try:
+        add_device(g1, "dev.1", [("out", "out"), ("in", "in")])
+        g1.poll()
+    finally:
+        g1.remove_callback(start_other_manager)
+    # the events that followed still reached the indexes
+    assert m1.get_sig_index().find("in", "dev.1")
+    add_device(g2, "dev.3", [("out3", "out")])
+    g2.poll()
+    assert m2.get_sig_index().find("out3", "dev.3")
+    m1.close()
+    m2.close()
+
+def test_module_functions_use_registered_manager():
+    g1 = make_graph({"dev.1": [("out", "out"), ("in", "in")]})
+    m1 = session.SessionManager(g1)
+    assert session.get_manager(g1) is m1
+    session.load_json(make_session([(["dev.1/out"], "dev.1/in")]), "one", graph=g1, validate=False)
+    assert len(m1.map_owners) == 1
+    m1.close()
+    assert session.get_manager(g1) is session.get_default_manager()
+
+def test_switching_off_does_not_sync():
+    # the graph of an interactive session is owned by its manager, and must not be synced on every toggle
+    manager = session.SessionManager()
+    graph = manager.check_graph(sync=False)
+    add_device(graph, "dev.1", [("out", "out"), ("in", "in")])
+    graph.poll()
+    filename = os.path.join(tempfile.mkdtemp(), "toggle.json")
+    with open(filename, "w") as f:
+        json.dump(make_session([(["dev.1/out"], "dev.1/in")]), f)
+    session.set_sync(0.2, 5.0)
+    try:
+        manager.switch_session(filename, True)
+        assert len(graph.maps()) == 1
+        start = time.perf_counter()
+        manager.switch_session(filename, False)
+        assert time.perf_counter() - start < 0.1
+        assert len(graph.maps()) == 0
+    finally:
+        session.set_sync(0.0, 0.0)
+        manager.close()
+
+if __name__ == '__main__':
+    run_tests(sys.modules[__name__])
@@ -0,0 +1,187 @@
+import json
+import os
+import sys
+import tempfile
+from fake_session import session, mpr, make_graph, make_session, run_tests
+
+# Tests for saving and loading session files, with the fake libmapper
+
+def test_fileversion():
+    graph = make_graph({"a.1": [("out1", "out"), ("out2", "out")], "b.1": [("in1", "in"), ("in2", "in")]})
+    directory = tempfile.mkdtemp()
+    original = os.path.join(directory, "original.json")
+    with open(original, "w") as f:
+        json.dump(make_session([(["a.1/out1"], "b.1/in1"), (["a.1/out2"], "b.1/in2")]), f)
+    manager = session.SessionManager(graph)
+    manager.load(original)
+
+    # sessions without tables are saved as 2.4, so a round trip keeps the loaded file's version
+    plain = os.path.join(directory, "plain.json")
+    assert manager.save(plain)["fileversion"] == "2.4"
+    with open(original) as f:
+        data = json.load(f)
+    with open(plain) as f:
+        saved = json.load(f)
+    assert saved["fileversion"] == data["fileversion"]
+    assert len(saved["maps"]) == len(data["maps"])
+    tables = os.path.join(directory, "tables.json")
+    manager.save(tables, tables=True)
+    with open(tables) as f:
+        assert json.load(f)["fileversion"] == "2.5"
+
+    # both load again, and migrating leaves them alone
+    assert session.prepare_file(plain) is not None and session.prepare_file(tables) is not None
+    assert [result["status"] for result in session.migrate([plain, tables], workers=1)] == ["current", "current"]
+    manager.close()
+
+def saved_maps(filename):
+    with open(filename) as f:
+        return sorted((map["sources"], map["destinations"]) for map in json.load(f)["maps"])
+
+def test_filtered_save():
+    graph = make_graph({"a.1": [("out1", "out"), ("out2", "out")], "b.1": [("in1", "in"), ("in2", "in")],
+                        "c.1": [("out3", "out"), ("in3", "in")]})
+    manager = session.SessionManager(graph)
+    manager.load_json(make_session([(["a.1/out1"], "b.1/in1"), (["a.1/out2"], "b.1/in2")]), "ab")
+    manager.load_json(make_session([(["c.1/out3"], "c.1/in3"), (["a.1/out1"], "c.1/in3")]), "c")
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "filtered.json")
+
+    manager.save(filename, devices=["c.1"])
+    assert saved_maps(filename) == [(["a.1/out1"], ["c.1/in3"]), (["c.1/out3"], ["c.1/in3"])]
+    manager.save(filename, signals=["a.1/out"])
+    assert len(saved_maps(filename)) == 3
+    manager.save(filename, signals="b.1/in2")
+    assert saved_maps(filename) == [(["a.1/out2"], ["b.1/in2"])]
+    manager.save(filename, tag="ab")
+    assert saved_maps(filename) == [(["a.1/out1"], ["b.1/in1"]), (["a.1/out2"], ["b.1/in2"])]
+
+    # filters are combined
+    manager.save(filename, devices=["a.1"], tag="c")
+    assert saved_maps(filename) == [(["a.1/out1"], ["c.1/in3"])]
+    manager.save(filename, devices=["a.1"], signals=["b.1/in1"], tag="c")
+    assert saved_maps(filename) == []
+    manager.close()
+
+def test_incremental_save():
+    graph = make_graph({"a.1": [("out1", "out"), ("out2", "out")], "b.1": [("in1", "in"), ("in2", "in")]})
+    manager = session.SessionManager(graph)
+    manager.load_json(make_session([(["a.1/out1"], "b.1/in1"), (["a.1/out2"], "b.1/in2")]), "ab")
+    filename = os.path.join(tempfile.mkdtemp(), "incremental.json")
+    # the first save tags the maps with the file's session, so save again before they are unchanged
+    manager.save(filename)
+    manager.save(filename, incremental=True)
+
+    # only the changed map is collected again
+    changed = [map for map in graph.maps() if map.signals(mpr.Map.Location.DESTINATION)[0]["name"] == "in1"][0]
+    changed[mpr.Property.EXPRESSION] = "y=4*x"
+    changed.push()
+    graph.poll()
+    manager.save(filename, incremental=True)
+    assert manager.last_stats().counts["reused"] == 1
+    with open(filename) as f:
+        expressions = sorted(map["expression"] for map in json.load(f)["maps"])
+    assert expressions == ["y=4*x", "y=x"]
+
+    # and the records are read from the file if it was saved by another process
+    session.saved_sessions.clear()
+    manager.save(filename, incremental=True)
+    assert manager.last_stats().counts["reused"] == 2
+    manager.close()
+
+def test_incremental_save_of_recreated_map():
+    graph = make_graph({"a.1": [("out1", "out")], "b.1": [("in1", "in")]})
+    manager = session.SessionManager(graph)
+    manager.load_json(make_session([(["a.1/out1"], "b.1/in1")]), "a")
+    filename = os.path.join(tempfile.mkdtemp(), "incremental.json")
+    manager.save(filename)
+    manager.save(filename, incremental=True)
+    old = graph.maps()[0]
+
+    # a map created again between the same signals, with the version the old map was saved with
+    old.release()
+    graph.poll()
+    new = mpr.Map(old.signals(mpr.Map.Location.SOURCE)[0], old.signals(mpr.Map.Location.DESTINATION)[0])
+    new[mpr.Property.EXPRESSION] = "y=7*x"
+    new.push()
+    while new["version"] < old["version"]:
+        new.push()
+    graph.poll()
+    assert new["version"] == old["version"]
+    manager.save(filename, incremental=True)
+    assert manager.last_stats().counts.get("reused", 0) == 0
+    with open(filename) as f:
+        assert [map["expression"] for map in json.load(f)["maps"]] == ["y=7*x"]
+    manager.close()
+
+def test_table_validation():
+    tables = {"fileversion": "2.5", "description": "", "values": [], "views": [], "devices": ["a.1", "b.1"],
+              "signals": [[0, "out1"], [1, "in1"]], "defaults": {"expression": "y=x"},
+              "maps": [{"sources": [0], "destinations": [1], "scope": [0]}]}
+    prepared = session.prepare_json(json.loads(json.dumps(tables)), "tables")
+    assert prepared["maps"] == [{"expression": "y=x", "sources": ["a.1/out1"], "destinations": ["b.1/in1"],
+                                 "scope": ["a.1"], "session": "tables"}]
+
+    # maps need an expression unless the defaults have one
+    del tables["defaults"]
+    assert session.prepare_json(json.loads(json.dumps(tables))) is None
+    tables["maps"][0]["expression"] = "y=x"
+    assert session.prepare_json(json.loads(json.dumps(tables))) is not None
+
+    # indices are only valid in sessions with tables, and must be in the tables
+    tables["maps"][0]["sources"] = [2]
+    assert session.prepare_json(json.loads(json.dumps(tables))) is None
+    plain = make_session([(["a.1/out1"], "b.1/in1")])
+    plain["maps"][0]["sources"] = [0]
+    assert session.prepare_json(json.loads(json.dumps(plain))) is None
+    plain["maps"][0]["sources"] = ["a.1/out1"]
+    plain["maps"][0]["scope"] = [0]
+    assert session.prepare_json(plain) is None
+
+    graph = make_graph({"a.1": [("out1", "out")], "b.1": [("in1", "in")]})
+    manager = session.SessionManager(graph)
+    plain["maps"][0]["scope"] = ["a.1"]
+    plain["maps"][0]["destinations"] = [1]
+    assert manager.load_json(plain) == (None, None)
+    assert len(graph.maps()) == 0
+    manager.close()
+
+def test_failed_save_keeps_previous_file():
+    graph = make_graph({"a.1": [("out1", "out"), ("out2", "out")], "b.1": [("in1", "in"), ("in2", "in")]})
+    manager = session.SessionManager(graph)
+    manager.load_json(make_session([(["a.1/out1"], "b.1/in1"), (["a.1/out2"], "b.1/in2")]), "ab")
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "saved.json.gz")
+    manager.save(filename, stream=True)
+    os.chmod(filename, 0o640)
+    with session.open_session_file(filename) as f:
+        previous = f.read()
+
+    # an error while the maps are being collected and streamed
+    add_map_properties = session.add_map_properties
+    def failing(record, map):
+        if map.signals(mpr.Map.Location.DESTINATION)[0]["name"] == "in2":
+            raise RuntimeError("lost the graph")
+        return add_map_properties(record, map)
+    session.add_map_properties = failing
+    try:
+        manager.save(filename, stream=True)
+        assert False, "the save should fail"
+    except RuntimeError:
+        pass
+    finally:
+        session.add_map_properties = add_map_properties
+    with session.open_session_file(filename) as f:
+        assert f.read() == previous
+    assert os.listdir(directory) == ["saved.json.gz"]
+
+    # replaced files keep their permissions, and new files get the usual ones
+    manager.save(filename, stream=True)
+    assert os.stat(filename).st_mode & 0o777 == 0o640
+    other = os.path.join(directory, "other.json")
+    manager.save(other)
+    assert os.stat(other).st_mode & 0o777 == 0o666 & ~session.file_umask
+    manager.close()
+
+if __name__ == '__main__':
+    run_tests(sys.modules[__name__])
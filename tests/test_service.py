@@ -0,0 +1,82 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from fake_session import session, service, make_graph, add_device, make_session, run_tests
+
+# Tests for the asyncio SessionService, with the fake libmapper
+
+def session_file(maps, name="session.json"):
+    filename = os.path.join(tempfile.mkdtemp(), name)
+    with open(filename, "w") as f:
+        json.dump(make_session(maps), f)
+    return filename
+
+def test_coalesced_load_and_unload():
+    graph = make_graph({"dev.1": [("out", "out"), ("in", "in")]})
+    filename = session_file([(["dev.1/out"], "dev.1/in")])
+
+    async def run():
+        async with service.SessionService(graph, poll_interval=0.01) as s:
+            # the unload replaces the queued load, which returns the result of a replaced load
+            loaded, unloaded = await asyncio.gather(s.load(filename), s.unload(filename))
+            assert loaded == (None, None)
+            assert isinstance(unloaded, session.SessionStats)
+            assert len(graph.maps()) == 0
+
+            # and the other way round
+            unloaded, loaded = await asyncio.gather(s.unload(filename), s.load(filename))
+            assert unloaded is None
+            views, values = loaded
+            assert len(graph.maps()) == 1
+
+            # repeated loads share the result of the one that runs
+            first, second = await asyncio.gather(s.load(filename), s.load(filename))
+            assert first == second
+    asyncio.run(run())
+
+def test_save_uses_manager():
+    graph = make_graph({"dev.1": [("out1", "out"), ("in1", "in")], "dev.2": [("out2", "out"), ("in2", "in")]})
+    filename = session_file([(["dev.1/out1"], "dev.1/in1"), (["dev.2/out2"], "dev.2/in2")])
+    saved = os.path.join(tempfile.mkdtemp(), "saved.json")
+
+    async def run():
+        async with service.SessionService(graph, poll_interval=0.01) as s:
+            await s.load(filename)
+            result = await s.save(saved, "saved", devices=["dev.1"])
+            assert [map["sources"] for map in result["maps"]] == [["dev.1/out1"]]
+            # saves through the manager keep the records for incremental saves
+            assert os.path.abspath(saved) in session.saved_sessions
+            await s.save(saved, "saved", incremental=True)
+            assert s.manager.last_stats().counts["maps"] == 2
+    asyncio.run(run())
+    with open(saved) as f:
+        assert len(json.load(f)["maps"]) == 2
+
+def test_start_syncs_own_graph():
+    filename = session_file([(["dev.1/out"], "dev.1/in")])
+
+    async def run():
+        s = service.SessionService(poll_interval=0.01)
+        starting = asyncio.ensure_future(s.start())
+        await asyncio.sleep(0.05)
+        # devices announced while syncing delay the start until the graph is quiet
+        add_device(s.graph, "dev.1", [("out", "out"), ("in", "in")])
+        await asyncio.sleep(0.1)
+        assert not starting.done()
+        await starting
+        try:
+            await s.load(filename)
+            assert len(s.graph.maps()) == 1
+        finally:
+            await s.stop()
+
+    session.set_sync(0.2, 5.0)
+    try:
+        asyncio.run(run())
+    finally:
+        session.set_sync(0.0, 0.0)
+
+if __name__ == '__main__':
+    run_tests(sys.modules[__name__])
@@ -0,0 +1,113 @@
+import sys
+import time
+from fake_session import session, make_graph, add_device, make_session, run_tests
+
+# Tests for staged maps, with the fake libmapper
+
+def staged_maps(num):
+    return make_session([(["late.{0}/out".format(i)], "late.{0}/in".format(i)) for i in range(num)])["maps"]
+
+def test_expire_after_heap_rebuild():
+    # unstaging an expired map can rebuild the deadline heap while expire_staged() is walking it
+    manager = session.SessionManager(make_graph({}))
+    now = time.monotonic()
+    a, = manager.stage_maps(staged_maps(1), {}, now + 0.03)
+    b, = manager.stage_maps(staged_maps(1), {}, now + 0.001)
+    for i in range(70):
+        manager.extend_staged(a, 0.02)
+    time.sleep(0.05)
+    assert manager.expire_staged(time.monotonic()) is None
+    assert manager.list_staged() == []
+    manager.close()
+
+def test_wait_expires_on_time():
+    manager = session.SessionManager(make_graph({}))
+    start = time.monotonic()
+    manager.load_json(make_session([(["late.1/out"], "late.1/in")]), "late", wait=0.2, background=True,
+                      validate=False)
+    assert len(manager.list_staged()) == 1
+    manager.staging_thread.join()
+    assert 0.2 <= time.monotonic() - start < 0.5
+    assert manager.list_staged() == []
+    manager.close()
+
+def test_staged_maps_are_created_when_signals_appear():
+    graph = make_graph({})
+    manager = session.SessionManager(graph)
+    manager.load_json(make_session([(["late.1/out"], "late.1/in")]), "late", wait=5, background=True,
+                      validate=False)
+    handle = manager.list_staged()[0]["handle"]
+    assert manager.extend_staged(handle, 10)
+    with manager.lock:
+        add_device(graph, "late.1", [("out", "out"), ("in", "in")])
+    manager.staging_thread.join(2)
+    assert len(graph.maps()) == 1 and manager.list_staged() == []
+    assert not manager.cancel_staged(handle)
+    manager.close()
+
+def test_staged_maps_are_created_together():
+    # maps staged together are retried with one push and verify phase rather than one per map
+    graph = make_graph({})
+    manager = session.SessionManager(graph)
+    calls = []
+    try_make_maps = manager.try_make_maps
+    def counted(maps, **options):
+        calls.append(len(maps))
+        return try_make_maps(maps, **options)
+    manager.try_make_maps = counted
+    manager.load_json(make_session([(["late.1/out{0}".format(i)], "late.1/in{0}".format(i)) for i in range(20)]),
+                      "late", wait=5, background=True, validate=False)
+    sigs = [("out{0}".format(i), "out") for i in range(20)] + [("in{0}".format(i), "in") for i in range(20)]
+    with manager.lock:
+        add_device(graph, "late.1", sigs)
+    manager.staging_thread.join(2)
+    assert manager.list_staged() == []
+    # the maps may also be tried together before the device appears
+    assert calls and set(calls) == {20}
+    manager.close()
+
+def test_failed_maps_are_retried():
+    graph = make_graph({})
+    manager = session.SessionManager(graph)
+    attempts = []
+    try_make_maps = manager.try_make_maps
+    def failing(maps, **options):
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            # e.g. the map isn't activated in time although both signals are present
+            return {"created": [], "failed": [], "timed_out": list(maps), "updated": [], "unchanged": [],
+                    "released": []}
+        return try_make_maps(maps, **options)
+    manager.try_make_maps = failing
+    with manager.lock:
+        add_device(graph, "dev.1", [("out", "out"), ("in", "in")])
+    manager.load_json(make_session([(["dev.1/out"], "dev.1/in")]), "retry", wait=True, background=True,
+                      validate=False)
+    manager.staging_thread.join(2)
+    assert manager.staging_thread is None
+    assert len(graph.maps()) == 1 and manager.list_staged() == []
+    # with a growing delay between the attempts
+    assert len(attempts) == 3 and attempts[2] - attempts[1] > attempts[1] - attempts[0]
+    manager.close()
+
+def test_cancel_and_persist():
+    graph = make_graph({})
+    manager = session.SessionManager(graph)
+    manager.load_json(make_session([(["late.1/out"], "late.1/in")]), "late", persist=True, background=True,
+                      validate=False)
+    staged, = manager.list_staged()
+    assert staged["persist"] and staged["expires"] is None
+    with manager.lock:
+        add_device(graph, "late.1", [("out", "out"), ("in", "in")])
+    deadline = time.monotonic() + 2
+    while not graph.maps() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # persistent maps stay staged after they have been created
+    assert len(graph.maps()) == 1 and len(manager.list_staged()) == 1
+    assert manager.cancel_staged(staged["handle"])
+    manager.staging_thread.join(2)
+    assert manager.staging_thread is None
+    manager.close()
+
+if __name__ == '__main__':
+    run_tests(sys.modules[__name__])